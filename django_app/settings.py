@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 import os
+import tempfile
 import django_heroku
 from pathlib import Path
 
@@ -46,12 +47,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'sales.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'sales.middleware.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'sales.middleware.AuditMiddleware',
+    'sales.middleware.ProfilerMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -59,7 +64,8 @@ ROOT_URLCONF = 'django_app.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, with render time reported by TimingMiddleware
+        'BACKEND': 'sales.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -86,6 +92,18 @@ DATABASES = {
     }
 }
 
+# Customers and orders are sharded by sales rep profile over these database
+# aliases; everything else lives on 'default' (see sales.sharding and
+# settings_sharded.py)
+SALES_SHARDS = ['default']
+
+DATABASE_ROUTERS = ['sales.sharding.ShardRouter']
+
+# Profile -> shard lookups are cached here; with several shards it must be a
+# cache shared by all workers
+SHARD_MAP_CACHE_ALIAS = 'default'
+SHARD_MAP_TIMEOUT = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -125,6 +143,57 @@ USE_TZ = True
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATIC_URL = '/static/'
 
+# Cache
+# The product catalog cache and the shard map keep gunicorn workers coherent
+# through the shared cache, so it must be visible to every worker: by default a
+# directory in the system temp dir, or CACHE_LOCATION when set.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'mycrm-cache')),
+    }
+}
+
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_MAX_ENTRIES = 128
+# Entries expire after this many seconds, which bounds staleness if the cache
+# is not shared after all (see sales.checks)
+CATALOG_CACHE_TIMEOUT = 300
+# Workers read the shared version stamp at most once per this many seconds
+CATALOG_CACHE_CHECK_INTERVAL = 1.0
+
+# Price bands for product facets, as (lower bound inclusive, upper bound exclusive)
+PRODUCT_PRICE_BANDS = [
+    (None, 10),
+    (10, 50),
+    (50, 100),
+    (100, None),
+]
+
+# Unfiltered admin changelists on tables above this many rows show an estimated count
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Duplicate customer detection (see sales.dedup)
+DEDUP_MATCH_THRESHOLD = 0.5
+DEDUP_MAX_BLOCK_SIZE = 50
+
+# Request metrics
+# With several gunicorn workers, point METRICS_DIR at a directory shared by the
+# workers (emptied on deploy) so /metrics merges all of them.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1.0
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Sampling profiler
+# Captures are stored under PROFILER_DIR for requests sent with a signed
+# X-Profile-Token header (see the profile_token command), for staff requests
+# with ?_profile=1 and, when PROFILER_SLOW_THRESHOLD is set, for every request
+# slower than that many seconds.
+PROFILER_DIR = os.environ.get('PROFILER_DIR')
+PROFILER_INTERVAL = 0.005
+PROFILER_SLOW_THRESHOLD = float(os.environ['PROFILER_SLOW_THRESHOLD']) if os.environ.get('PROFILER_SLOW_THRESHOLD') else None
+PROFILER_TOKEN_MAX_AGE = 3600
+
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
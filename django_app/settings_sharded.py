@@ -0,0 +1,27 @@
+# Local setup with customers and orders sharded over three SQLite files.
+#
+#   python manage.py migrate --settings=django_app.settings_sharded --database=shard_1
+#   python manage.py test --settings=django_app.settings_sharded
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_shard_1.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_db_shard_1.sqlite3'},
+    },
+    'shard_2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_shard_2.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_db_shard_2.sqlite3'},
+    },
+}
+
+SALES_SHARDS = ['default', 'shard_1', 'shard_2']
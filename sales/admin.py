@@ -1,8 +1,140 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Customer, Product, Order, Profile
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import Customer, Product, Order, Profile, AuditLog, StockAlert
+from . import alerts, sharding
 
 
-admin.site.register(Customer)
-admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(Profile)
+class EstimatedCountPaginator(Paginator):
+    # COUNT(*) on a large PostgreSQL table is a full scan. For unfiltered
+    # changelists over the threshold, use the planner's row estimate instead.
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                                   [queryset.model._meta.db_table])
+                    row = cursor.fetchone()
+                if row is not None and row[0] > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                    return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+
+
+class ShardFilter(admin.SimpleListFilter):
+    # Changelists of sharded models show one shard at a time, the first by default
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.shards()]
+
+    def value(self):
+        value = super().value()
+        return value if value in sharding.shards() else sharding.shards()[0]
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.value())
+
+
+class ShardedAdmin(LargeTableAdmin):
+    # Relations to models on the default database cannot be joined on a shard
+    cross_shard_related = ()
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if len(sharding.shards()) > 1:
+            list_filter = (ShardFilter,) + tuple(list_filter)
+        return list_filter
+
+    def get_list_select_related(self, request):
+        list_select_related = super().get_list_select_related(request)
+        if len(sharding.shards()) > 1:
+            list_select_related = tuple(name for name in list_select_related
+                                        if name not in self.cross_shard_related)
+        return list_select_related
+
+    def get_object(self, request, object_id, from_field=None):
+        # Ids are unique across shards, so the first shard holding the id wins
+        queryset = self.get_queryset(request)
+        field = queryset.model._meta.pk if from_field is None else queryset.model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except (ValidationError, ValueError):
+            return None
+        for alias in sharding.shards():
+            obj = queryset.using(alias).filter(**{field.name: object_id}).first()
+            if obj is not None:
+                return obj
+        return None
+
+
+@admin.register(Profile)
+class ProfileAdmin(LargeTableAdmin):
+    list_display = ('username', 'first_name', 'last_name', 'email', 'start_date')
+    search_fields = ('username', 'first_name', 'last_name', 'email')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Customer)
+class CustomerAdmin(ShardedAdmin):
+    list_display = ('name', 'email', 'phone', 'user_profile', 'join_date')
+    list_select_related = ('user_profile',)
+    cross_shard_related = ('user_profile',)
+    search_fields = ('name', 'email', 'phone')
+    autocomplete_fields = ('user_profile',)
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('name', 'price', 'inventory', 'reorder_threshold', 'stock')
+    list_filter = ('stock',)
+    search_fields = ('name',)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        alerts.evaluate([obj])
+
+
+@admin.register(Order)
+class OrderAdmin(ShardedAdmin):
+    list_display = ('id', 'order_date', 'customer', 'product', 'quantity', 'line_total', 'status')
+    list_select_related = ('customer', 'product')
+    cross_shard_related = ('product',)
+    list_filter = ('status', 'order_date')
+    autocomplete_fields = ('customer', 'product')
+    readonly_fields = ('unit_price', 'line_total')
+
+
+@admin.register(StockAlert)
+class StockAlertAdmin(LargeTableAdmin):
+    list_display = ('product', 'inventory', 'threshold', 'created_at', 'resolved_at')
+    list_select_related = ('product',)
+    raw_id_fields = ('product',)
+
+
+@admin.register(AuditLog)
+class AuditLogAdmin(LargeTableAdmin):
+    list_display = ('timestamp', 'object_type', 'object_id', 'action', 'user')
+    list_select_related = ('user',)
+    list_filter = ('object_type', 'action')
+    raw_id_fields = ('user',)
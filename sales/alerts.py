@@ -0,0 +1,60 @@
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, Max
+from django.dispatch import Signal
+from django.utils import timezone
+from . import metrics
+from .models import StockAlert
+
+
+# Sent once per alert, when a product first drops to its reorder threshold
+low_stock = Signal()
+
+metrics.register('crm_stock_alerts_total', 'counter', None, 'event', 'Low-stock alerts opened and resolved')
+
+
+def needs_reorder(product):
+    return product.inventory <= product.reorder_threshold
+
+
+def _open(product):
+    if StockAlert.objects.open().filter(product=product).exists():
+        return None
+    try:
+        with transaction.atomic(using=router.db_for_write(StockAlert)):
+            alert = StockAlert.objects.create(
+                product=product, inventory=product.inventory, threshold=product.reorder_threshold)
+    except IntegrityError:
+        # Opened concurrently; the partial unique index keeps one per product
+        return None
+    metrics.registry.inc('crm_stock_alerts_total', 'opened')
+    low_stock.send(sender=StockAlert, alert=alert)
+    return alert
+
+
+def evaluate(products):
+    # Only the products whose inventory or threshold just changed are passed
+    # in, so the cost does not depend on the size of the catalog. Returns the
+    # alerts opened by this call.
+    opened = []
+    for product in products:
+        if needs_reorder(product):
+            alert = _open(product)
+            if alert is not None:
+                opened.append(alert)
+        else:
+            resolved = StockAlert.objects.open().filter(product=product).update(resolved_at=timezone.now())
+            metrics.registry.inc('crm_stock_alerts_total', 'resolved', resolved)
+    return opened
+
+
+def validator():
+    # Changes whenever an alert is opened or resolved, for conditional GET. Only
+    # open alerts are read, through their partial index, so the cost does not
+    # grow with the alert history.
+    summary = StockAlert.objects.open().aggregate(count=Count('id'), latest=Max('created_at'))
+    return [summary['count'], summary['latest']]
+
+
+def reorder_queue():
+    # Open alerts, oldest first, read through the partial index on open alerts
+    return StockAlert.objects.open().select_related('product').order_by('created_at')
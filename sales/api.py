@@ -0,0 +1,170 @@
+import base64
+
+from django.http import JsonResponse
+from . import conditional
+from .decorators import api_login_required
+from .models import Customer, Order, Product
+
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+CUSTOMER_RESOURCE = {
+    'fields': ['id', 'name', 'join_date', 'phone', 'email', 'address', 'user_profile_id'],
+    'include': {
+        'user_profile': ['id', 'first_name', 'last_name', 'email'],
+    },
+}
+
+ORDER_RESOURCE = {
+    'fields': ['id', 'customer_id', 'product_id', 'quantity', 'status', 'order_date'],
+    'include': {
+        'customer': ['id', 'name'],
+        'product': ['id', 'name', 'price'],
+    },
+}
+
+PRODUCT_RESOURCE = {
+    'fields': ['id', 'name', 'price', 'inventory', 'stock'],
+    'include': {},
+}
+
+
+class APIError(Exception):
+    pass
+
+
+def _parse_list(request, name):
+    return [item for item in request.GET.get(name, '').split(',') if item]
+
+
+def _parse_ids(values):
+    try:
+        return [int(value) for value in values]
+    except ValueError:
+        raise APIError('ids must be integers')
+
+
+def _encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except ValueError:
+        raise APIError('Invalid cursor')
+
+
+def _columns(request, resource):
+    fields = _parse_list(request, 'fields') or resource['fields']
+    unknown = [field for field in fields if field not in resource['fields']]
+    if unknown:
+        raise APIError('Unknown fields: ' + ', '.join(unknown))
+    if 'id' not in fields:
+        fields = ['id'] + fields
+
+    include = _parse_list(request, 'include')
+    unknown = [name for name in include if name not in resource['include']]
+    if unknown:
+        raise APIError('Unknown include: ' + ', '.join(unknown))
+
+    return fields, include
+
+
+def _include(rows, queryset, include, resource, fields):
+    # Each included relation is fetched with one bulk query by primary key, as
+    # related rows may live on a different database than the rows themselves
+    for name in include:
+        attname = name + '_id'
+        model = queryset.model._meta.get_field(name).related_model
+        ids = {row[attname] for row in rows if row[attname] is not None}
+        related = {}
+        if ids:
+            related = {obj['id']: obj for obj in model.objects.filter(pk__in=ids).values(*resource['include'][name])}
+        for row in rows:
+            row[name] = related.get(row[attname])
+            if attname not in fields:
+                del row[attname]
+    return rows
+
+
+def _validator(request, queryset, include):
+    # Built from MAX(updated_at)/COUNT of the listed rows and of every included
+    # table, so a 304 costs a few aggregates instead of the full listing.
+    # Included tables without updated_at cannot be validated this way.
+    related = [queryset.model._meta.get_field(name).related_model for name in include]
+    if any(not hasattr(model, 'updated_at') for model in related):
+        return None
+    return conditional.etag_for(request, queryset, *[model.objects.all() for model in related])
+
+
+def _list(request, queryset, resource):
+    try:
+        fields, include = _columns(request, resource)
+        ids = _parse_ids(_parse_list(request, 'ids'))
+    except APIError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Conditional GET
+    etag = _validator(request, queryset, include)
+    if etag is not None:
+        response = conditional.not_modified(request, etag)
+        if response is not None:
+            return response
+
+    try:
+        columns = fields + [name + '_id' for name in include if name + '_id' not in fields]
+        queryset = queryset.order_by('-id').values(*columns)
+        next_cursor = None
+
+        if ids:
+            # Bulk lookup by primary key, without pagination
+            if len(ids) > MAX_PAGE_SIZE:
+                raise APIError('At most %d ids per request' % MAX_PAGE_SIZE)
+            rows = list(queryset.filter(pk__in=ids))
+        else:
+            try:
+                limit = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+            except ValueError:
+                raise APIError('limit must be an integer')
+            if limit < 1:
+                raise APIError('limit must be positive')
+
+            cursor = request.GET.get('cursor')
+            if cursor:
+                queryset = queryset.filter(id__lt=_decode_cursor(cursor))
+
+            # Fetch one extra row to know whether there is a next page
+            rows = list(queryset[:limit + 1])
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = _encode_cursor(rows[-1]['id'])
+    except APIError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    data = _include(rows, queryset, include, resource, fields)
+    response = JsonResponse({'data': data, 'next_cursor': next_cursor})
+    if etag is None:
+        return response
+    return conditional.with_etag(response, etag)
+
+
+# Customers API
+@api_login_required
+def customer_list(request):
+    queryset = Customer.objects.filter(user_profile=request.user.profile)
+    return _list(request, queryset, CUSTOMER_RESOURCE)
+
+
+# Orders API
+@api_login_required
+def order_list(request):
+    queryset = Order.objects.filter(customer__user_profile=request.user.profile)
+    return _list(request, queryset, ORDER_RESOURCE)
+
+
+# Products API
+@api_login_required
+def product_list(request):
+    return _list(request, Product.objects.all(), PRODUCT_RESOURCE)
@@ -6,4 +6,5 @@ class SalesConfig(AppConfig):
     name = 'sales'
 
     def ready(self):
+        import sales.checks
         import sales.signals
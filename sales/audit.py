@@ -0,0 +1,133 @@
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from django.db import transaction
+
+_local = threading.local()
+_fields_cache = {}
+
+
+def _is_derived(field):
+    # Modification timestamps and other non-editable columns recomputed on
+    # every save (blocking keys) are not worth logging; creation dates are
+    if getattr(field, 'auto_now', False):
+        return True
+    return not field.editable and not getattr(field, 'auto_now_add', False)
+
+
+def _audited_fields(model):
+    fields = _fields_cache.get(model)
+    if fields is None:
+        fields = [f.attname for f in model._meta.concrete_fields if not f.primary_key and not _is_derived(f)]
+        _fields_cache[model] = fields
+    return fields
+
+
+def snapshot(instance):
+    # Deferred fields are not in __dict__ and are left out of the diff
+    values = instance.__dict__
+    return {name: values[name] for name in _audited_fields(type(instance)) if name in values}
+
+
+def diff(old, new):
+    return {name: [old[name], value] for name, value in new.items()
+            if name in old and old[name] != value}
+
+
+def current_user_id():
+    get_user = getattr(_local, 'get_user', None)
+    user = get_user() if get_user is not None else None
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return None
+
+
+def _enqueue(entry):
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = _local.committed
+    buffer.append(entry)
+
+
+def _flush_committed():
+    from .models import AuditLog
+
+    entries, _local.committed = _local.committed, []
+    if entries:
+        AuditLog.objects.bulk_create(entries)
+
+
+def _schedule_flush(connection):
+    # Outside buffered(), the entries of a transaction are written by a single
+    # bulk_create from a hook kept behind all of their _enqueue hooks. The hook
+    # is held outside any savepoint, so rolling one back only drops that
+    # savepoint's entries; rolling back the transaction drops the hook as well.
+    # There is no public API for this: it relies on connection.run_on_commit
+    # holding tuples that start with (savepoint ids, func), which AuditTests pin.
+    hooks = connection.run_on_commit
+    if len(hooks) >= 2 and hooks[-2][1] is _flush_committed:
+        hooks[-2], hooks[-1] = hooks[-1], hooks[-2]
+        return
+    hooks[:] = [hook for hook in hooks if hook[1] is not _flush_committed]
+    # Let Django build the hook, whatever else it holds, then detach it from
+    # the current savepoints
+    connection.on_commit(_flush_committed)
+    hooks.append((set(),) + tuple(hooks.pop()[1:]))
+
+
+def record(instance, action, changes, using=None):
+    from .models import AuditLog
+
+    entry = AuditLog(
+        object_type=instance._meta.model_name,
+        object_id=instance.pk,
+        action=action,
+        changes=changes,
+        user_id=current_user_id(),
+    )
+    buffer = getattr(_local, 'buffer', None)
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        # Autocommit: the change is already committed
+        if buffer is not None:
+            buffer.append(entry)
+        else:
+            AuditLog.objects.bulk_create([entry])
+        return
+
+    if not hasattr(_local, 'committed'):
+        _local.committed = []
+    # Entries only reach a buffer once the surrounding transaction commits,
+    # so rolled back changes are never logged
+    connection.on_commit(partial(_enqueue, entry))
+    if buffer is None:
+        _schedule_flush(connection)
+
+
+def flush():
+    from .models import AuditLog
+
+    buffer = getattr(_local, 'buffer', None)
+    if buffer:
+        AuditLog.objects.bulk_create(buffer)
+        _local.buffer = []
+
+
+@contextmanager
+def buffered(get_user=None):
+    # Collect audit entries in memory and write them with one bulk_create on exit
+    if getattr(_local, 'buffer', None) is not None:
+        yield
+        return
+
+    _local.buffer = []
+    _local.get_user = get_user
+    try:
+        yield
+    finally:
+        try:
+            flush()
+        finally:
+            _local.buffer = None
+            _local.get_user = None
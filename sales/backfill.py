@@ -0,0 +1,76 @@
+from django.db.models import DecimalField, ExpressionWrapper, F, Value
+from django.utils import timezone
+
+
+# Backfills run by the management commands. They take model classes and
+# database aliases so they can run against each shard. Data migrations carry
+# their own copies instead of importing these.
+
+def batched_pks(queryset, batch_size=1000):
+    # Walk the primary key index so every batch is a cheap range scan
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def backfill_order_totals(Order, Product, DashboardOrderRow=None, batch_size=1000, using='default',
+                          products_using=None):
+    # Prices are read separately because products may live on another database
+    # than the orders. The dashboard rows, kept next to the products, get the
+    # same totals: the updates below send no signals to sync them.
+    orders = Order.objects.using(using)
+    products = Product.objects.using(products_using or using)
+    pending = orders.filter(line_total__isnull=True, product__isnull=False)
+
+    updated = 0
+    for pks in batched_pks(pending, batch_size):
+        product_ids = set(orders.filter(pk__in=pks).values_list('product_id', flat=True))
+        for product_id, price in products.filter(pk__in=product_ids).values_list('pk', 'price'):
+            line_total = ExpressionWrapper(F('quantity') * Value(price),
+                                           output_field=DecimalField(max_digits=12, decimal_places=2))
+            updated += orders.filter(pk__in=pks, product_id=product_id).update(
+                unit_price=price, line_total=line_total)
+            if DashboardOrderRow is not None:
+                DashboardOrderRow.objects.using(products_using or using).filter(
+                    order_id__in=pks, product_id=product_id).update(line_total=line_total, updated_at=timezone.now())
+    return updated
+
+
+def backfill_dashboard_rows(Order, Product, DashboardOrderRow, batch_size=1000, using='default', rows_using=None):
+    # Orders and customers are read from `using`; products and the rows
+    # themselves live on `rows_using`
+    rows_using = rows_using or using
+    orders = Order.objects.using(using)
+    products = Product.objects.using(rows_using)
+
+    created = 0
+    for pks in batched_pks(orders, batch_size):
+        batch = list(orders.filter(pk__in=pks).values(
+            'id', 'order_date', 'customer_id', 'customer__name', 'customer__user_profile_id',
+            'product_id', 'quantity', 'line_total', 'status'))
+        product_names = dict(products.filter(
+            pk__in={order['product_id'] for order in batch}).values_list('pk', 'name'))
+        rows = [
+            DashboardOrderRow(
+                order_id=order['id'],
+                order_date=order['order_date'],
+                customer_id=order['customer_id'],
+                customer_name=order['customer__name'],
+                product_id=order['product_id'],
+                product_name=product_names.get(order['product_id']),
+                quantity=order['quantity'],
+                line_total=order['line_total'],
+                status=order['status'],
+                user_profile_id=order['customer__user_profile_id'],
+            )
+            for order in batch
+        ]
+        DashboardOrderRow.objects.using(rows_using).bulk_create(rows)
+        created += len(rows)
+    return created
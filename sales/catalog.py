@@ -0,0 +1,146 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from . import metrics
+from .models import Product
+
+
+_missing = object()
+
+metrics.register('crm_cache_hits_total', 'counter', None, 'route', 'Cache hits')
+metrics.register('crm_cache_misses_total', 'counter', None, 'route', 'Cache misses')
+metrics.register('crm_catalog_cache_events_total', 'counter', None, 'event',
+                 'Product catalog cache hits, misses and evictions')
+
+
+class TwoTierCache:
+    # A bounded in-process LRU in front of a shared Django cache. Every entry is
+    # stored under a version stamp kept in the shared cache; invalidate() replaces
+    # the stamp, which every worker sees on its next check and drops its LRU.
+    # The stamp is read at most once per check_interval seconds, and a finite
+    # timeout bounds staleness when the cache is not shared after all.
+    def __init__(self, namespace, alias='default', max_entries=128, timeout=None, check_interval=0):
+        self.namespace = namespace
+        self.alias = alias
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked = 0.0
+        self.stats = {'local_hit': 0, 'shared_hit': 0, 'miss': 0, 'eviction': 0}
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    @property
+    def version_key(self):
+        return self.namespace + ':version'
+
+    def _count(self, event):
+        self.stats[event] += 1
+        metrics.registry.inc('crm_catalog_cache_events_total', self.namespace + ':' + event)
+        if event == 'miss':
+            metrics.cache_miss()
+        elif event != 'eviction':
+            metrics.cache_hit()
+
+    def current_version(self):
+        version = self.shared.get(self.version_key)
+        if version is None:
+            # Random stamps never repeat, so entries written under an evicted or
+            # concurrently replaced stamp can never be read back as current
+            self.shared.add(self.version_key, uuid.uuid4().hex, self.timeout)
+            version = self.shared.get(self.version_key)
+        return version
+
+    def version(self):
+        # The stamp the LRU serves from. Stamps only move forward, so entries
+        # read after this call are at least this new, and a page rendered from
+        # them can use it as its validator.
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._checked < self.check_interval:
+                return self._version
+        version = self.current_version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked = now
+        return version
+
+    def get(self, key, loader):
+        version = self.version()
+        with self._lock:
+            value = self._entries.get(key, _missing) if version == self._version else _missing
+            if value is not _missing:
+                self._entries.move_to_end(key)
+        if value is not _missing:
+            self._count('local_hit')
+            return value
+
+        shared_key = '%s:%s:%s' % (self.namespace, version, key)
+        value = self.shared.get(shared_key, _missing)
+        if value is _missing:
+            self._count('miss')
+            value = loader()
+            self.shared.set(shared_key, value, self.timeout)
+        else:
+            self._count('shared_hit')
+
+        evicted = 0
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    evicted += 1
+        for _ in range(evicted):
+            self._count('eviction')
+        return value
+
+    def invalidate(self):
+        self.shared.set(self.version_key, uuid.uuid4().hex, self.timeout)
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+catalog_cache = TwoTierCache(
+    'catalog',
+    alias=getattr(settings, 'CATALOG_CACHE_ALIAS', 'default'),
+    max_entries=getattr(settings, 'CATALOG_CACHE_MAX_ENTRIES', 128),
+    timeout=getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300),
+    check_interval=getattr(settings, 'CATALOG_CACHE_CHECK_INTERVAL', 1.0),
+)
+
+
+def product_choices():
+    return catalog_cache.get('choices', lambda: list(Product.objects.order_by('id').values_list('id', 'name')))
+
+
+def product_names():
+    return dict(product_choices())
+
+
+class CachedProductList:
+    # Sliceable stand-in for Product.objects.order_by('-id') that Paginator can
+    # page through, serving the count and each page from the catalog cache
+    def count(self):
+        return catalog_cache.get('count', lambda: Product.objects.count())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        key = 'products:%s:%s' % (index.start, index.stop)
+        return catalog_cache.get(key, lambda: list(Product.objects.order_by('-id')[index]))
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+
+# Backends whose contents are private to one process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _is_process_local(alias):
+    return settings.CACHES.get(alias, {}).get('BACKEND') in PROCESS_LOCAL_CACHES
+
+
+@register(Tags.caches)
+def check_catalog_cache(app_configs, **kwargs):
+    # Without a shared backend, invalidations never reach the other workers,
+    # so only the entry timeout bounds how long they serve a stale catalog
+    alias = getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+    if not _is_process_local(alias):
+        return []
+    if getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300) is None:
+        return [Error(
+            'CATALOG_CACHE_TIMEOUT is None but the %r cache is process-local.' % alias,
+            hint='Point CATALOG_CACHE_ALIAS at a shared cache (e.g. set CACHE_LOCATION) '
+                 'or set a finite CATALOG_CACHE_TIMEOUT.',
+            id='sales.E001',
+        )]
+    return [Warning(
+        'The %r cache is process-local, so catalog changes only reach the other '
+        'workers when their entries expire.' % alias,
+        hint='Point CATALOG_CACHE_ALIAS at a cache shared by every worker.',
+        id='sales.W001',
+    )]
+
+
+@register(Tags.caches, Tags.database)
+def check_shard_map_cache(app_configs, **kwargs):
+    # Moving a profile invalidates the shard map; a process-local cache would
+    # keep the other workers writing to the old shard
+    alias = getattr(settings, 'SHARD_MAP_CACHE_ALIAS', 'default')
+    if len(getattr(settings, 'SALES_SHARDS', [])) > 1 and _is_process_local(alias):
+        return [Error(
+            'SALES_SHARDS lists several shards but the %r cache is process-local.' % alias,
+            hint='Point SHARD_MAP_CACHE_ALIAS at a cache shared by every worker.',
+            id='sales.E002',
+        )]
+    return []
@@ -0,0 +1,31 @@
+import hashlib
+
+from django.contrib import messages
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+
+
+# Conditional GET helpers shared by the HTML views and the JSON API
+
+def etag_for(request, *querysets, extra=()):
+    # MAX(updated_at) changes when a row is edited and COUNT when one is
+    # deleted. The user and the full path (search, filters, page) are part of
+    # the tag because they change what the same data renders as.
+    parts = [request.user.pk, request.get_full_path()] + list(extra)
+    for queryset in querysets:
+        summary = queryset.order_by().aggregate(latest=Max('updated_at'), count=Count('pk'))
+        parts += [summary['latest'], summary['count']]
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def not_modified(request, etag):
+    # Pending flash messages are only shown by rendering the page
+    if len(messages.get_messages(request)):
+        return None
+    return get_conditional_response(request, etag=etag)
+
+
+def with_etag(response, etag):
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -1,3 +1,4 @@
+from django.http import JsonResponse
 from django.shortcuts import redirect
 
 
@@ -8,3 +9,13 @@ def unauthenticated_user(view_func):
         else:
             return view_func(request, *args, **kwargs)
     return wrapper_func
+
+
+def api_login_required(view_func):
+    # API clients get a JSON 401 instead of a redirect to the login page
+    def wrapper_func(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        else:
+            return view_func(request, *args, **kwargs)
+    return wrapper_func
@@ -0,0 +1,186 @@
+import re
+import unicodedata
+from collections import namedtuple
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+
+# Customers are only compared with the other customers of the same rep that
+# share at least one blocking key, and blocks larger than DEDUP_MAX_BLOCK_SIZE
+# (placeholder emails, shared switchboard numbers) are skipped altogether.
+BLOCKING_KEYS = ['email_key', 'phone_key', 'name_key']
+
+# Weight of each matching key; the name also scores partial token overlap
+WEIGHTS = {'email_key': 0.5, 'phone_key': 0.4, 'name_key': 0.3}
+
+MERGED_FIELDS = ['phone', 'email', 'address']
+
+Duplicate = namedtuple('Duplicate', ['customer', 'duplicate', 'score', 'reasons'])
+
+
+def normalize_email(email):
+    local, sep, domain = (email or '').strip().lower().partition('@')
+    if not sep or not local or not domain:
+        return None
+    local = local.split('+', 1)[0]
+    if domain in ('gmail.com', 'googlemail.com'):
+        local = local.replace('.', '')
+        domain = 'gmail.com'
+    return (local + '@' + domain)[:200]
+
+
+def normalize_phone(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    # Anything shorter cannot tell two customers apart
+    return digits[:100] if len(digits) >= 7 else None
+
+
+def name_tokens(name):
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    return sorted(set(re.findall(r'\w+', name)))
+
+
+def normalize_name(name):
+    # Sorted tokens, so "Smith, John" and "john smith" share a block
+    return ' '.join(name_tokens(name))[:200] or None
+
+
+def blocking_keys(name, phone, email):
+    return {
+        'email_key': normalize_email(email),
+        'phone_key': normalize_phone(phone),
+        'name_key': normalize_name(name),
+    }
+
+
+def score(first, second):
+    reasons = []
+    total = 0.0
+    for key in ('email_key', 'phone_key'):
+        if first[key] is not None and first[key] == second[key]:
+            total += WEIGHTS[key]
+            reasons.append(key[:-4])
+    first_tokens = set((first['name_key'] or '').split())
+    second_tokens = set((second['name_key'] or '').split())
+    if first_tokens and second_tokens:
+        overlap = len(first_tokens & second_tokens) / len(first_tokens | second_tokens)
+        if overlap:
+            total += WEIGHTS['name_key'] * overlap
+            reasons.append('name')
+    return round(total, 2), reasons
+
+
+def find_duplicates(queryset, threshold=None, max_block_size=None):
+    # Likely duplicates among `queryset`, best matches first. Each blocking key
+    # costs one GROUP BY over its index plus one query for the blocks' members.
+    threshold = threshold if threshold is not None else settings.DEDUP_MATCH_THRESHOLD
+    max_block_size = max_block_size or settings.DEDUP_MAX_BLOCK_SIZE
+    queryset = queryset.order_by()
+
+    rows = {}
+    pairs = set()
+    for key in BLOCKING_KEYS:
+        blocks = queryset.filter(**{key + '__isnull': False}).values(key).annotate(
+            size=Count('id')).filter(size__gt=1, size__lte=max_block_size).values(key)
+        members = {}
+        for row in queryset.filter(**{key + '__in': blocks}).values('id', *BLOCKING_KEYS):
+            rows[row['id']] = row
+            members.setdefault(row[key], []).append(row['id'])
+        for ids in members.values():
+            pairs.update(combinations(sorted(ids), 2))
+
+    matches = []
+    for first, second in pairs:
+        value, reasons = score(rows[first], rows[second])
+        if value >= threshold:
+            matches.append((first, second, value, reasons))
+    if not matches:
+        return []
+
+    customers = queryset.in_bulk({pk for match in matches for pk in match[:2]})
+    matches.sort(key=lambda match: (-match[2], match[0], match[1]))
+    # The older record is kept and the newer one merged into it
+    return [Duplicate(customers[first], customers[second], value, reasons)
+            for first, second, value, reasons in matches]
+
+
+def similar_customers(customer, limit=5):
+    # Other customers of the same rep sharing any blocking key, through the indexes
+    from .models import Customer
+
+    condition = Q()
+    for key in BLOCKING_KEYS:
+        value = getattr(customer, key)
+        if value is not None:
+            condition |= Q(**{key: value})
+    if not condition:
+        return []
+    return list(Customer.objects.using(customer._state.db).filter(
+        condition, user_profile_id=customer.user_profile_id).exclude(pk=customer.pk).order_by('id')[:limit])
+
+
+def merge_customers(customer, duplicates):
+    # Fold `duplicates` into `customer`: their orders are re-pointed with one
+    # set-based update, blank contact fields are filled in from them and the
+    # duplicate records are deleted. The update bypasses the order signals, so
+    # each merged customer gets a 'merge' audit entry listing its moved orders.
+    from . import audit, readmodels
+    from .models import Customer, Order
+
+    duplicates = [duplicate for duplicate in duplicates if duplicate.pk != customer.pk]
+    if not duplicates:
+        return 0
+    ids = [duplicate.pk for duplicate in duplicates]
+    using = customer._state.db
+
+    with transaction.atomic(using=using):
+        for field in MERGED_FIELDS:
+            if not getattr(customer, field):
+                values = [getattr(duplicate, field) for duplicate in duplicates if getattr(duplicate, field)]
+                if values:
+                    setattr(customer, field, values[0])
+        customer.save()
+        moved = {pk: [] for pk in ids}
+        orders = Order.objects.using(using).filter(customer_id__in=ids)
+        for customer_id, order_id in orders.order_by('id').values_list('customer_id', 'id'):
+            moved[customer_id].append(order_id)
+        orders.update(customer=customer, updated_at=timezone.now())
+        readmodels.reassign_customers(ids, customer)
+        for duplicate in duplicates:
+            audit.record(duplicate, 'merge', {'merged_into': customer.pk, 'orders': moved[duplicate.pk]}, using=using)
+        Customer.objects.using(using).filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def merge_pairs(queryset, pairs):
+    # Batch merge of (customer_id, duplicate_id) pairs, restricted to
+    # `queryset`. Chains such as A <- B, B <- C all end up in A, with one merge
+    # (and one order update) per surviving customer.
+    target_of = {}
+
+    def resolve(pk):
+        while pk in target_of:
+            pk = target_of[pk]
+        return pk
+
+    for customer_id, duplicate_id in pairs:
+        customer_id, duplicate_id = resolve(customer_id), resolve(duplicate_id)
+        if customer_id != duplicate_id:
+            target_of[duplicate_id] = customer_id
+
+    customers = queryset.in_bulk(set(target_of) | set(target_of.values()))
+    groups = {}
+    for duplicate_id in target_of:
+        customer_id = resolve(duplicate_id)
+        if duplicate_id in customers and customer_id in customers:
+            groups.setdefault(customer_id, []).append(customers[duplicate_id])
+
+    merged = 0
+    for customer_id, duplicates in sorted(groups.items()):
+        merged += merge_customers(customers[customer_id], duplicates)
+    return merged
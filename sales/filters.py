@@ -1,8 +1,24 @@
 import django_filters
+from django.conf import settings
+from django.db.models import Count, Q
+from django.http import QueryDict
 from .models import Order, Product
 
 
+def facet_query(data, name, value):
+    query = QueryDict(mutable=True)
+    query.update(data)
+    query.pop('page', None)
+    if value is None:
+        query.pop(name, None)
+    else:
+        query[name] = value
+    return query.urlencode()
+
+
 class OrderFilter(django_filters.FilterSet):
+    FACET_FILTERS = ['product', 'status']
+
     start_date = django_filters.DateFilter(field_name='order_date', lookup_expr='gt')
     end_date = django_filters.DateFilter(field_name='order_date', lookup_expr='lt')
 
@@ -10,12 +26,147 @@ class OrderFilter(django_filters.FilterSet):
         model = Order
         fields = ['product', 'status', 'start_date', 'end_date']
 
+    def __init__(self, *args, **kwargs):
+        super(OrderFilter, self).__init__(*args, **kwargs)
+        # Only offer the products that appear in the orders being filtered.
+        # Orders and products can live on different databases, so the ids are
+        # fetched up front instead of through a subquery.
+        product_ids = set(self.queryset.order_by().values_list('product_id', flat=True).distinct())
+        self.filters['product'].queryset = Product.objects.filter(pk__in=product_ids)
+
+    def _cleaned_data(self):
+        return self.form.cleaned_data if self.is_bound else {}
+
+    def facets(self, product_names):
+        # Per-status and per-product counts from one GROUP BY (status, product)
+        # query. Like the product facets, each facet ignores its own selection.
+        if self.is_bound and not self.is_valid():
+            return None
+        data = self._cleaned_data()
+        queryset = self.queryset
+        for name, value in data.items():
+            if name not in self.FACET_FILTERS:
+                queryset = self.filters[name].filter(queryset, value)
+        rows = queryset.order_by().values_list('status', 'product_id').annotate(count=Count('id'))
+
+        selected_status = data.get('status') or None
+        selected_product = data.get('product').pk if data.get('product') else None
+        total = 0
+        status_counts = {}
+        product_counts = {}
+        for status, product_id, count in rows:
+            status_match = selected_status is None or status == selected_status
+            product_match = selected_product is None or product_id == selected_product
+            if product_match:
+                status_counts[status] = status_counts.get(status, 0) + count
+            if status_match and product_id is not None:
+                product_counts[product_id] = product_counts.get(product_id, 0) + count
+            if status_match and product_match:
+                total += count
+
+        return {
+            'total': total,
+            'status': [{
+                'label': label,
+                'count': status_counts.get(value, 0),
+                'selected': value == selected_status,
+                'query': facet_query(self.data, 'status', None if value == selected_status else value),
+            } for value, label in Order.ORDER_STATUS],
+            'product': [{
+                'label': product_names.get(product_id, product_id),
+                'count': count,
+                'selected': product_id == selected_product,
+                'query': facet_query(self.data, 'product', None if product_id == selected_product else str(product_id)),
+            } for product_id, count in sorted(product_counts.items(), key=lambda item: -item[1])],
+        }
+
+
+def price_band_label(low, high):
+    if low is None:
+        return 'Under $' + str(high)
+    if high is None:
+        return '$' + str(low) + ' and up'
+    return '$' + str(low) + ' - $' + str(high)
+
+
+def price_band_q(index):
+    low, high = settings.PRODUCT_PRICE_BANDS[index]
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
 
 class ProductFilter(django_filters.FilterSet):
+    FACET_FILTERS = ['stock', 'price_band']
+
     name = django_filters.CharFilter(lookup_expr='icontains')
     price__gt = django_filters.NumberFilter(field_name='price', lookup_expr='gt')
     price__lt = django_filters.NumberFilter(field_name='price', lookup_expr='lt')
+    price_band = django_filters.ChoiceFilter(label='Price band', method='filter_price_band', choices=[
+        (str(index), price_band_label(low, high)) for index, (low, high) in enumerate(settings.PRODUCT_PRICE_BANDS)
+    ])
 
     class Meta:
         model = Product
-        fields = ['name', 'stock', 'price__gt', 'price__lt']
+        fields = ['name', 'stock', 'price__gt', 'price__lt', 'price_band']
+
+    def filter_price_band(self, queryset, name, value):
+        return queryset.filter(price_band_q(int(value)))
+
+    def _cleaned_data(self):
+        # An empty query string leaves the filterset unbound, which selects everything
+        return self.form.cleaned_data if self.is_bound else {}
+
+    def _stock_q(self):
+        stock = self._cleaned_data().get('stock')
+        return Q(stock=stock) if stock else Q()
+
+    def _price_band_q(self):
+        band = self._cleaned_data().get('price_band')
+        return price_band_q(int(band)) if band else Q()
+
+    def facet_counts(self):
+        # Counts per stock level and price band in one conditional-aggregate
+        # query. Each facet ignores its own selection, so every option shows how
+        # many products it would select next to the other active filters.
+        queryset = self.queryset
+        for name, value in self._cleaned_data().items():
+            if name not in self.FACET_FILTERS:
+                queryset = self.filters[name].filter(queryset, value)
+
+        stock_q = self._stock_q()
+        band_q = self._price_band_q()
+        aggregates = {'total': Count('id', filter=stock_q & band_q)}
+        for index, (value, label) in enumerate(Product.STOCK_LEVEL):
+            aggregates['stock_%d' % index] = Count('id', filter=Q(stock=value) & band_q)
+        for index in range(len(settings.PRODUCT_PRICE_BANDS)):
+            aggregates['band_%d' % index] = Count('id', filter=price_band_q(index) & stock_q)
+        return queryset.order_by().aggregate(**aggregates)
+
+    def facets(self, counts=None):
+        if self.is_bound and not self.is_valid():
+            return None
+        if counts is None:
+            counts = self.facet_counts()
+
+        data = self._cleaned_data()
+        selected_stock = data.get('stock')
+        selected_band = data.get('price_band')
+        return {
+            'total': counts['total'],
+            'stock': [{
+                'label': label,
+                'count': counts['stock_%d' % index],
+                'selected': value == selected_stock,
+                'query': facet_query(self.data, 'stock', None if value == selected_stock else value),
+            } for index, (value, label) in enumerate(Product.STOCK_LEVEL)],
+            'price_bands': [{
+                'label': price_band_label(low, high),
+                'count': counts['band_%d' % index],
+                'selected': str(index) == selected_band,
+                'query': facet_query(self.data, 'price_band', None if str(index) == selected_band else str(index)),
+            } for index, (low, high) in enumerate(settings.PRODUCT_PRICE_BANDS)],
+        }
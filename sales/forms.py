@@ -2,12 +2,7 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from .models import Profile, Customer, Product, Order
-
-
-PRODUCT_CHOICES = Product.objects.all().values_list('name', 'name')
-product_list = []
-for item in PRODUCT_CHOICES:
-    product_list.append(item)
+from .catalog import product_choices
 
 
 class CustomerForm(forms.ModelForm):
@@ -21,21 +16,26 @@ class CustomerForm(forms.ModelForm):
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ['name', 'price', 'inventory']
+        fields = ['name', 'price', 'inventory', 'reorder_threshold']
 
 
-class OrderForm(forms.ModelForm):
+class OrderLineForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
-        super(OrderForm, self).__init__(*args, **kwargs)
-        self.fields['product'].disabled = True
-        self.fields['quantity'].disabled = True
+        super(OrderLineForm, self).__init__(*args, **kwargs)
+        # Render the product select from the catalog cache instead of querying Product
+        product_field = self.fields['product']
+        product_field.choices = [('', product_field.empty_label)] + product_choices()
 
     class Meta:
         model = Order
         fields = ['product', 'quantity', 'status']
-        widgets = {
-            'product': forms.Select(choices=product_list),
-        }
+
+
+class OrderForm(OrderLineForm):
+    def __init__(self, *args, **kwargs):
+        super(OrderForm, self).__init__(*args, **kwargs)
+        self.fields['product'].disabled = True
+        self.fields['quantity'].disabled = True
 
 
 class UserCreationForm(UserCreationForm):
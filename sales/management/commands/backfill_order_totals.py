@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import router
+from sales.backfill import backfill_order_totals
+from sales.models import Order, Product, DashboardOrderRow
+from sales.sharding import shards
+
+
+class Command(BaseCommand):
+    help = 'Snapshot unit_price and line_total on orders that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = 0
+        for alias in shards():
+            updated += backfill_order_totals(Order, Product, DashboardOrderRow, batch_size=options['batch_size'],
+                                             using=alias, products_using=router.db_for_read(Product))
+        self.stdout.write(self.style.SUCCESS('Backfilled %d orders.' % updated))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from sales.backfill import batched_pks
+from sales.models import Profile, Customer, Order, ShardAssignment
+from sales import sharding
+
+
+class Command(BaseCommand):
+    help = ("Move a sales rep's customers and orders to another shard. Run it while the rep is "
+            "not making changes: writes made during the copy are not carried over.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', type=int)
+        parser.add_argument('alias')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        profile_id = options['profile_id']
+        target = options['alias']
+        batch_size = options['batch_size']
+        if target not in sharding.shards():
+            raise CommandError('Unknown shard: %s' % target)
+        if not Profile.objects.filter(pk=profile_id).exists():
+            raise CommandError('Profile %d does not exist' % profile_id)
+        source = sharding.shard_for_profile(profile_id)
+        if source == target:
+            self.stdout.write('Profile %d is already on %s.' % (profile_id, target))
+            return
+
+        def customers(alias):
+            return Customer.objects.using(alias).filter(user_profile_id=profile_id)
+
+        def orders(alias):
+            return Order.objects.using(alias).filter(customer__user_profile_id=profile_id)
+
+        # Clear copies left behind by an interrupted run, then copy in batches,
+        # keeping primary keys. bulk_create sends no signals, so the audit log
+        # and dashboard rows are left alone.
+        orders(target)._raw_delete(target)
+        customers(target)._raw_delete(target)
+        moved = {}
+        for label, queryset in (('customers', customers(source)), ('orders', orders(source))):
+            moved[label] = 0
+            for pks in batched_pks(queryset, batch_size):
+                objs = list(queryset.model.objects.using(source).filter(pk__in=pks))
+                queryset.model.objects.using(target).bulk_create(objs, batch_size=batch_size)
+                moved[label] += len(objs)
+        sharding.reset_id_sequence(target)
+
+        # Switch reads and writes over, then drop the rows from the old shard
+        with transaction.atomic(using=router.db_for_write(ShardAssignment)):
+            ShardAssignment.objects.update_or_create(profile_id=profile_id, defaults={'alias': target})
+        for queryset in (orders(source), customers(source)):
+            for pks in batched_pks(queryset, batch_size):
+                queryset.model.objects.using(source).filter(pk__in=pks)._raw_delete(source)
+
+        self.stdout.write(self.style.SUCCESS('Moved %d customers and %d orders of profile %d from %s to %s.' % (
+            moved['customers'], moved['orders'], profile_id, source, target)))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from sales.profiler import make_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed X-Profile-Token header value for on-demand request profiling'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
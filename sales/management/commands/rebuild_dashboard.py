@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+from sales.backfill import backfill_dashboard_rows
+from sales.models import Order, Product, DashboardOrderRow
+from sales.sharding import shards
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized dashboard order rows from the orders table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows_using = router.db_for_write(DashboardOrderRow)
+        created = 0
+        with transaction.atomic(using=rows_using):
+            DashboardOrderRow.objects.using(rows_using).all().delete()
+            for alias in shards():
+                created += backfill_dashboard_rows(Order, Product, DashboardOrderRow, batch_size=options['batch_size'],
+                                                   using=alias, rows_using=rows_using)
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d dashboard rows.' % created))
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (type, histogram buckets, label, help). Series fed from outside the
+# request timings are added with register() by the module that feeds them.
+METRICS = {
+    'crm_request_duration_seconds': ('histogram', TIME_BUCKETS, 'route', 'Total time spent in the view'),
+    'crm_db_duration_seconds': ('histogram', TIME_BUCKETS, 'route', 'Time spent executing SQL'),
+    'crm_db_queries': ('histogram', COUNT_BUCKETS, 'route', 'Number of SQL queries per request'),
+    'crm_template_duration_seconds': ('histogram', TIME_BUCKETS, 'route', 'Time spent rendering templates'),
+}
+
+_local = threading.local()
+
+
+def register(name, kind, buckets, label, help_text):
+    METRICS.setdefault(name, (kind, buckets, label, help_text))
+
+
+class RequestTimings:
+    __slots__ = ('sql_time', 'sql_count', 'template_time', 'template_depth', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.sql_time = 0.0
+        self.sql_count = 0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # Used as a connection.execute_wrapper
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_count += 1
+
+    def add(self, other):
+        # Fold in the timings of work done for this request on another thread
+        self.sql_time += other.sql_time
+        self.sql_count += other.sql_count
+        self.template_time += other.template_time
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+
+
+def start_request():
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def end_request():
+    _local.timings = None
+
+
+def current():
+    return getattr(_local, 'timings', None)
+
+
+def cache_hit():
+    timings = current()
+    if timings is not None:
+        timings.cache_hits += 1
+
+
+def cache_miss():
+    timings = current()
+    if timings is not None:
+        timings.cache_misses += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, label, value):
+        buckets = METRICS[name][1]
+        index = bisect_left(buckets, value)
+        key = (name, label)
+        with self._lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def inc(self, name, label, amount=1):
+        if not amount:
+            return
+        key = (name, label)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': [[name, label, list(counts), total, count]
+                               for (name, label), (counts, total, count) in self.histograms.items()],
+                'counters': [[name, label, value] for (name, label), value in self.counters.items()],
+            }
+
+    def maybe_flush(self):
+        # Persist this worker's totals so /metrics can merge every gunicorn worker
+        directory = getattr(settings, 'METRICS_DIR', None)
+        now = time.monotonic()
+        if not directory or now - self._last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0):
+            return
+        self._last_flush = now
+        path = os.path.join(directory, 'metrics-%d.json' % os.getpid())
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+
+registry = Registry()
+
+
+def _merged_snapshots():
+    snapshots = [registry.snapshot()]
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory and os.path.isdir(directory):
+        own = 'metrics-%d.json' % os.getpid()
+        for filename in os.listdir(directory):
+            if not filename.startswith('metrics-') or not filename.endswith('.json') or filename == own:
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    histograms = {}
+    counters = {}
+    for snapshot in snapshots:
+        for name, label, counts, total, count in snapshot['histograms']:
+            if name not in METRICS:
+                continue
+            merged = histograms.setdefault((name, label), [[0] * len(counts), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+        for name, label, value in snapshot['counters']:
+            if name in METRICS:
+                counters[(name, label)] = counters.get((name, label), 0) + value
+    return histograms, counters
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render():
+    histograms, counters = _merged_snapshots()
+    lines = []
+    for name, (kind, buckets, label_name, help_text) in METRICS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        if kind == 'histogram':
+            for (series_name, label), (counts, total, count) in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                label = '%s="%s"' % (label_name, _escape(label))
+                cumulative = 0
+                for bound, value in zip(buckets, counts):
+                    cumulative += value
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, label, bound, cumulative))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, label, count))
+                lines.append('%s_sum{%s} %s' % (name, label, repr(total)))
+                lines.append('%s_count{%s} %d' % (name, label, count))
+        else:
+            for (series_name, label), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append('%s{%s="%s"} %d' % (name, label_name, _escape(label), value))
+    return '\n'.join(lines) + '\n'
+
+
+class TimedTemplate(Template):
+    # Django only sends template_rendered under the test runner, so the
+    # template time is measured here, once per render() call in a view
+    def render(self, context=None, request=None):
+        timings = current()
+        if timings is None or timings.template_depth:
+            # Templates rendered from inside another template (e.g. crispy
+            # forms) are already counted by the outer render
+            return super().render(context, request)
+        timings.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_time += time.perf_counter() - start
+            timings.template_depth -= 1
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # The Django template backend, returning TimedTemplate instances
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
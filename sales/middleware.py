@@ -0,0 +1,107 @@
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections
+from . import audit, metrics, profiler, sharding
+
+
+class AuditMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with audit.buffered(get_user=lambda: getattr(request, 'user', None)):
+            return self.get_response(request)
+
+
+class ShardMiddleware:
+    # Route the request's customer and order queries to the shard of the
+    # logged in sales rep, looked up on first use
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with sharding.use_shard(get_profile_id=lambda: self.profile_id(request)):
+            return self.get_response(request)
+
+    def profile_id(self, request):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        try:
+            return user.profile.id
+        except ObjectDoesNotExist:
+            return None
+
+
+class TimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            metrics.end_request()
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = match.view_name if match is not None else 'unmatched'
+        registry = metrics.registry
+        registry.observe('crm_request_duration_seconds', route, total)
+        registry.observe('crm_db_duration_seconds', route, timings.sql_time)
+        registry.observe('crm_db_queries', route, timings.sql_count)
+        registry.observe('crm_template_duration_seconds', route, timings.template_time)
+        registry.inc('crm_cache_hits_total', route, timings.cache_hits)
+        registry.inc('crm_cache_misses_total', route, timings.cache_misses)
+        registry.maybe_flush()
+
+        server_timing = 'total;dur=%.2f, db;dur=%.2f;desc="%d queries", tpl;dur=%.2f' % (
+            total * 1000, timings.sql_time * 1000, timings.sql_count, timings.template_time * 1000)
+        if timings.cache_hits or timings.cache_misses:
+            server_timing += ', cache;desc="%d hits, %d misses"' % (timings.cache_hits, timings.cache_misses)
+        response['Server-Timing'] = server_timing
+        return response
+
+
+class ProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PROFILER_DIR:
+            return self.get_response(request)
+
+        threshold = settings.PROFILER_SLOW_THRESHOLD
+        requested = self.is_requested(request)
+        if not requested and threshold is None:
+            return self.get_response(request)
+
+        thread_id = threading.get_ident()
+        capture = profiler.sampler.start(thread_id)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.sampler.stop(thread_id)
+        duration = time.perf_counter() - start
+
+        if requested or duration >= threshold:
+            match = request.resolver_match
+            route = match.view_name if match is not None else 'unmatched'
+            response['X-Profile-Capture'] = profiler.save(capture, route, duration)
+        return response
+
+    def is_requested(self, request):
+        token = request.headers.get('X-Profile-Token')
+        if token and profiler.check_token(token):
+            return True
+        return request.GET.get('_profile') == '1' and request.user.is_staff
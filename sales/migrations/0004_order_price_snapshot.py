@@ -0,0 +1,48 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:45
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, Value
+
+BATCH_SIZE = 1000
+
+
+def snapshot_order_prices(apps, schema_editor):
+    Order = apps.get_model('sales', 'Order')
+    Product = apps.get_model('sales', 'Product')
+    orders = Order.objects.using(schema_editor.connection.alias)
+    products = Product.objects.using(schema_editor.connection.alias)
+    pending = orders.filter(line_total__isnull=True, product__isnull=False).order_by('pk')
+
+    # Walk the primary key index so every batch is a cheap range scan
+    last_pk = 0
+    while True:
+        pks = list(pending.filter(pk__gt=last_pk).values_list('pk', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        product_ids = set(orders.filter(pk__in=pks).values_list('product_id', flat=True))
+        for product_id, price in products.filter(pk__in=product_ids).values_list('pk', 'price'):
+            line_total = ExpressionWrapper(F('quantity') * Value(price),
+                                           output_field=DecimalField(max_digits=12, decimal_places=2))
+            orders.filter(pk__in=pks, product_id=product_id).update(unit_price=price, line_total=line_total)
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0003_auditlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='line_total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(snapshot_order_prices, migrations.RunPython.noop),
+    ]
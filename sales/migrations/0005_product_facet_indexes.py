@@ -0,0 +1,21 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_order_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['stock', 'price'], name='sales_produ_stock_fbf0f0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='sales_produ_price_1a3e27_idx'),
+        ),
+    ]
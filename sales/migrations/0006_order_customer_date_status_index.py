@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0005_product_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'order_date', 'status'], name='sales_order_custome_acdfff_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def build_dashboard_rows(apps, schema_editor):
+    Order = apps.get_model('sales', 'Order')
+    DashboardOrderRow = apps.get_model('sales', 'DashboardOrderRow')
+    orders = Order.objects.using(schema_editor.connection.alias).order_by('pk')
+    rows = DashboardOrderRow.objects.using(schema_editor.connection.alias)
+
+    # Walk the primary key index so every batch is a cheap range scan
+    last_pk = 0
+    while True:
+        batch = list(orders.filter(pk__gt=last_pk).values(
+            'id', 'order_date', 'customer_id', 'customer__name', 'customer__user_profile_id',
+            'product_id', 'product__name', 'quantity', 'line_total', 'status')[:BATCH_SIZE])
+        if not batch:
+            break
+        rows.bulk_create([
+            DashboardOrderRow(
+                order_id=order['id'],
+                order_date=order['order_date'],
+                customer_id=order['customer_id'],
+                customer_name=order['customer__name'],
+                product_id=order['product_id'],
+                product_name=order['product__name'],
+                quantity=order['quantity'],
+                line_total=order['line_total'],
+                status=order['status'],
+                user_profile_id=order['customer__user_profile_id'],
+            )
+            for order in batch
+        ])
+        last_pk = batch[-1]['id']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0006_order_customer_date_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardOrderRow',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dashboard_row', serialize=False, to='sales.order')),
+                ('order_date', models.DateField()),
+                ('customer_id', models.BigIntegerField(null=True)),
+                ('customer_name', models.CharField(max_length=200, null=True)),
+                ('product_id', models.BigIntegerField(null=True)),
+                ('product_name', models.CharField(max_length=100, null=True)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('status', models.CharField(max_length=50)),
+                ('user_profile_id', models.BigIntegerField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dashboardorderrow',
+            index=models.Index(fields=['customer_id'], name='sales_dashb_custome_216253_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dashboardorderrow',
+            index=models.Index(fields=['product_id'], name='sales_dashb_product_5a01f9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dashboardorderrow',
+            index=models.Index(fields=['user_profile_id', 'order'], name='sales_dashb_user_pr_88f46c_idx'),
+        ),
+        migrations.RunPython(build_dashboard_rows, migrations.RunPython.noop),
+    ]
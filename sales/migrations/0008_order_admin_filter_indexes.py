@@ -0,0 +1,21 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0007_dashboardorderrow'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'order_date'], name='sales_order_status_a80236_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['order_date'], name='sales_order_order_d_0a2432_idx'),
+        ),
+    ]
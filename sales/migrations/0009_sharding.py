@@ -0,0 +1,37 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0008_order_admin_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='user_profile',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='sales.profile'),
+        ),
+        migrations.AlterField(
+            model_name='dashboardorderrow',
+            name='order',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='dashboard_row', serialize=False, to='sales.order'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='sales.product'),
+        ),
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=100)),
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='sales.profile')),
+            ],
+        ),
+    ]
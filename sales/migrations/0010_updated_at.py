@@ -0,0 +1,78 @@
+# Generated by Django 3.2.5 on 2026-10-19 18:10
+
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+
+def stamp_updated_at(apps, schema_editor):
+    # Rows from before updated_at existed are stamped with the time of the migration
+    now = timezone.now()
+    for name in ['Customer', 'DashboardOrderRow', 'Order', 'Product']:
+        rows = apps.get_model('sales', name).objects.using(schema_editor.connection.alias)
+        # Walk the primary key index so every batch is a cheap range scan
+        last_pk = 0
+        while True:
+            pks = list(rows.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+            if not pks:
+                break
+            rows.filter(pk__in=pks, updated_at__isnull=True).update(updated_at=now)
+            last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0009_sharding'),
+    ]
+
+    # The columns are added as nullable, filled in batches and only then made
+    # NOT NULL, so existing rows never need a one-off default
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dashboardorderrow',
+            name='updated_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(stamp_updated_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='dashboardorderrow',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'updated_at'], name='sales_order_custome_4bf626_idx'),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 3.2.5 on 2026-10-19 17:05
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+# Copies of the sales.dedup normalizers as of this migration
+def normalize_email(email):
+    local, sep, domain = (email or '').strip().lower().partition('@')
+    if not sep or not local or not domain:
+        return None
+    local = local.split('+', 1)[0]
+    if domain in ('gmail.com', 'googlemail.com'):
+        local = local.replace('.', '')
+        domain = 'gmail.com'
+    return (local + '@' + domain)[:200]
+
+
+def normalize_phone(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[:100] if len(digits) >= 7 else None
+
+
+def normalize_name(name):
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    return ' '.join(sorted(set(re.findall(r'\w+', name))))[:200] or None
+
+
+def compute_blocking_keys(apps, schema_editor):
+    Customer = apps.get_model('sales', 'Customer')
+    customers = Customer.objects.using(schema_editor.connection.alias).order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(customers.filter(pk__gt=last_pk).only('name', 'phone', 'email')[:BATCH_SIZE])
+        if not batch:
+            break
+        for customer in batch:
+            customer.email_key = normalize_email(customer.email)
+            customer.phone_key = normalize_phone(customer.phone)
+            customer.name_key = normalize_name(customer.name)
+        customers.bulk_update(batch, ['email_key', 'phone_key', 'name_key'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='email_key',
+            field=models.CharField(editable=False, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='phone_key',
+            field=models.CharField(editable=False, max_length=100, null=True),
+        ),
+        migrations.RunPython(compute_blocking_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['user_profile', 'email_key'], name='sales_custo_user_pr_93e82d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['user_profile', 'phone_key'], name='sales_custo_user_pr_72b0f8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['user_profile', 'name_key'], name='sales_custo_user_pr_bf83d2_idx'),
+        ),
+    ]
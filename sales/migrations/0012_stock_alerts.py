@@ -0,0 +1,61 @@
+# Generated by Django 3.2.5 on 2026-10-19 17:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import F
+
+BATCH_SIZE = 1000
+
+
+def open_stock_alerts(apps, schema_editor):
+    # Open an alert for every product already at or below its reorder threshold
+    Product = apps.get_model('sales', 'Product')
+    StockAlert = apps.get_model('sales', 'StockAlert')
+    low = Product.objects.using(schema_editor.connection.alias).filter(
+        inventory__lte=F('reorder_threshold')).order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(low.filter(pk__gt=last_pk).values_list('pk', 'inventory', 'reorder_threshold')[:BATCH_SIZE])
+        if not batch:
+            break
+        StockAlert.objects.using(schema_editor.connection.alias).bulk_create([
+            StockAlert(product_id=pk, inventory=inventory, threshold=threshold)
+            for pk, inventory, threshold in batch
+        ])
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0011_customer_blocking_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reorder_threshold',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inventory', models.IntegerField()),
+                ('threshold', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_alerts', to='sales.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stockalert',
+            index=models.Index(condition=models.Q(('resolved_at__isnull', True)), fields=['created_at'], name='sales_stockalert_open_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockalert',
+            constraint=models.UniqueConstraint(condition=models.Q(('resolved_at__isnull', True)), fields=('product',), name='sales_stockalert_one_open_per_product'),
+        ),
+        migrations.RunPython(open_stock_alerts, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 from django.db import models
 from django.core.validators import MinValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 from decimal import Decimal
+from .dedup import blocking_keys
 
 
 class Profile(models.Model):
@@ -20,16 +23,35 @@ class Profile(models.Model):
 
 
 class Customer(models.Model):
-    user_profile = models.ForeignKey(Profile, null=True, on_delete=models.SET_NULL)
+    # Profiles stay on the default database while customers are sharded, so the
+    # foreign key cannot be enforced by the database (see sales.sharding)
+    user_profile = models.ForeignKey(Profile, null=True, on_delete=models.SET_NULL, db_constraint=False)
     name = models.CharField(max_length=200, null=True)
     join_date = models.DateField(auto_now_add=True)
     phone = models.CharField(max_length=100)
     email = models.CharField(max_length=200)
     address = models.CharField(max_length=300)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Normalized blocking keys for duplicate detection (see sales.dedup)
+    email_key = models.CharField(max_length=200, null=True, editable=False)
+    phone_key = models.CharField(max_length=100, null=True, editable=False)
+    name_key = models.CharField(max_length=200, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_profile', 'email_key']),
+            models.Index(fields=['user_profile', 'phone_key']),
+            models.Index(fields=['user_profile', 'name_key']),
+        ]
 
     def __str__(self):
         return str(self.name)
 
+    def save(self, *args, **kwargs):
+        for key, value in blocking_keys(self.name, self.phone, self.email).items():
+            setattr(self, key, value)
+        super().save(*args, **kwargs)
+
 
 class Product(models.Model):
     STOCK_LEVEL = (
@@ -40,6 +62,15 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     inventory = models.IntegerField(default=0, blank=False)
     stock = models.CharField(max_length=100, choices=STOCK_LEVEL, default='')
+    # A low-stock alert opens when inventory drops to this level (see sales.alerts)
+    reorder_threshold = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock', 'price']),
+            models.Index(fields=['price']),
+        ]
 
     def __str__(self):
         return self.name
@@ -61,17 +92,151 @@ class Order(models.Model):
     )
 
     customer = models.ForeignKey(Customer, null=True, on_delete=models.SET_NULL)
-    product = models.ForeignKey(Product, null=True, on_delete=models.SET_NULL)
+    product = models.ForeignKey(Product, null=True, on_delete=models.SET_NULL, db_constraint=False)
     quantity = models.PositiveIntegerField(default=0)
     status = models.CharField(max_length=50, choices=ORDER_STATUS)
     order_date = models.DateField(auto_now_add=True)
+    # Price snapshot taken when the order is placed
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'order_date', 'status']),
+            models.Index(fields=['customer', 'updated_at']),
+            models.Index(fields=['status', 'order_date']),
+            models.Index(fields=['order_date']),
+        ]
 
     def __str__(self):
-        return self.product.name + ' - ' + str(self.quantity)
+        return str(self.product) + ' - ' + str(self.quantity)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded product, so switching it takes a new price snapshot
+        if 'product_id' in instance.__dict__:
+            instance._loaded_product_id = instance.product_id
+        return instance
+
+    def save(self, *args, **kwargs):
+        product_changed = self.product_id != getattr(self, '_loaded_product_id', self.product_id)
+        if self.product_id is not None and (self.unit_price is None or product_changed):
+            self.unit_price = self.product.price
+        if self.unit_price is not None:
+            self.line_total = self.quantity * Decimal(self.unit_price)
+        super().save(*args, **kwargs)
+        self._loaded_product_id = self.product_id
 
     def total_price(self):
+        if self.line_total is not None:
+            return self.line_total
         total_price = self.quantity * self.product.price
         return total_price
 
     def get_absolute_url(self):
         return reverse('sales:detail', kwargs={'pk': self.customer.pk})
+
+
+class DashboardOrderRow(models.Model):
+    # Denormalized copy of an Order for the dashboard, kept in sync by sales.readmodels
+    # Rows stay on the default database, so orders on other shards cannot cascade to them
+    order = models.OneToOneField(Order, primary_key=True, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 related_name='dashboard_row')
+    order_date = models.DateField()
+    customer_id = models.BigIntegerField(null=True)
+    customer_name = models.CharField(max_length=200, null=True)
+    product_id = models.BigIntegerField(null=True)
+    product_name = models.CharField(max_length=100, null=True)
+    quantity = models.PositiveIntegerField(default=0)
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    status = models.CharField(max_length=50)
+    user_profile_id = models.BigIntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer_id']),
+            models.Index(fields=['product_id']),
+            models.Index(fields=['user_profile_id', 'order']),
+        ]
+
+    def __str__(self):
+        return str(self.product_name) + ' - ' + str(self.quantity)
+
+
+class StockAlertQuerySet(models.QuerySet):
+    def open(self):
+        return self.filter(resolved_at__isnull=True)
+
+
+class StockAlert(models.Model):
+    # Open while the product is at or below its reorder threshold; resolved on restock
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_alerts')
+    inventory = models.IntegerField()
+    threshold = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    objects = StockAlertQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # At most one open alert per product, so alerts are raised once until restocked
+            models.UniqueConstraint(fields=['product'], condition=models.Q(resolved_at__isnull=True),
+                                    name='sales_stockalert_one_open_per_product'),
+        ]
+        indexes = [
+            # The "needs reorder" queue only ever reads open alerts
+            models.Index(fields=['created_at'], condition=models.Q(resolved_at__isnull=True),
+                         name='sales_stockalert_open_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.product) + ' - ' + str(self.inventory)
+
+
+class ShardAssignment(models.Model):
+    # Which database alias holds a sales rep's customers and orders
+    profile = models.OneToOneField(Profile, on_delete=models.CASCADE)
+    alias = models.CharField(max_length=100)
+
+    def __str__(self):
+        return str(self.profile) + ' - ' + self.alias
+
+
+class AuditLogQuerySet(models.QuerySet):
+    def for_object(self, obj):
+        return self.filter(object_type=obj._meta.model_name, object_id=obj.pk)
+
+    def between(self, start, end):
+        return self.filter(timestamp__gte=start, timestamp__lt=end)
+
+
+class AuditLog(models.Model):
+    ACTIONS = (
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+        ('merge', 'Merge'),
+    )
+
+    object_type = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    # Only the changed fields: {field: [old, new]} for updates, {field: value} for creates
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='+')
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    objects = AuditLogQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['object_type', 'object_id', 'timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
+
+    def __str__(self):
+        return self.object_type + ' #' + str(self.object_id) + ' ' + self.action
@@ -0,0 +1,161 @@
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+
+TOKEN_SALT = 'sales.profiler'
+MAX_DEPTH = 128
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def check_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILER_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class Capture:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, frame):
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def collapsed(self):
+        lines = []
+        for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+            names = ['%s (%s:%d)' % frame for frame in stack]
+            lines.append(';'.join(names) + ' ' + str(count))
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self, name, duration, interval):
+        frames = []
+        index = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                sample.append(index[frame])
+            samples.append(sample)
+            weights.append(count * interval)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': duration,
+                'samples': samples,
+                'weights': weights,
+            }],
+            'name': name,
+            'exporter': 'mycrm',
+        }
+
+
+class Sampler:
+    # One background thread samples the stacks of every thread being profiled,
+    # so profiling a request costs a dict insert instead of a thread per request
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.active = {}
+
+    def start(self, thread_id):
+        capture = Capture()
+        with self._lock:
+            self.active[thread_id] = capture
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sales-profiler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return capture
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self.active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            if not self.active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(settings.PROFILER_INTERVAL)
+            frames = sys._current_frames()
+            # Samples are added under the lock, so once stop() returns no
+            # other thread touches the capture while it is being saved
+            with self._lock:
+                for thread_id, capture in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        capture.add(frame)
+
+
+sampler = Sampler()
+
+
+def save(capture, route, duration):
+    directory = settings.PROFILER_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = '%s-%s-%dms-%s' % (
+        timezone.now().strftime('%Y%m%d-%H%M%S'),
+        route.replace(':', '-'),
+        duration * 1000,
+        uuid.uuid4().hex[:6],
+    )
+    with open(os.path.join(directory, name + '.collapsed.txt'), 'w') as f:
+        f.write(capture.collapsed())
+    with open(os.path.join(directory, name + '.speedscope.json'), 'w') as f:
+        json.dump(capture.speedscope(route, duration, settings.PROFILER_INTERVAL), f)
+    return name
+
+
+def list_captures():
+    directory = settings.PROFILER_DIR
+    if not directory or not os.path.isdir(directory):
+        return []
+    captures = []
+    for filename in os.listdir(directory):
+        if filename.endswith('.collapsed.txt') or filename.endswith('.speedscope.json'):
+            stat = os.stat(os.path.join(directory, filename))
+            captures.append({
+                'name': filename,
+                'size': stat.st_size,
+                'modified': datetime.datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+            })
+    captures.sort(key=lambda capture: capture['name'], reverse=True)
+    return captures
+
+
+def capture_path(filename):
+    # Only plain file names from the capture directory can be downloaded
+    if filename not in {capture['name'] for capture in list_captures()}:
+        return None
+    return os.path.join(settings.PROFILER_DIR, filename)
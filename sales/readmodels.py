@@ -0,0 +1,53 @@
+from django.utils import timezone
+from .models import DashboardOrderRow
+
+
+def sync_order(order):
+    # The order form and formsets attach customer and product instances, so
+    # this normally costs no extra queries beyond the row write
+    customer = order.customer
+    product = order.product
+    DashboardOrderRow(
+        order_id=order.pk,
+        order_date=order.order_date,
+        customer_id=order.customer_id,
+        customer_name=customer.name if customer is not None else None,
+        product_id=order.product_id,
+        product_name=product.name if product is not None else None,
+        quantity=order.quantity,
+        line_total=order.line_total,
+        status=order.status,
+        user_profile_id=customer.user_profile_id if customer is not None else None,
+    ).save()
+
+
+def remove_order(order_id):
+    DashboardOrderRow.objects.filter(order_id=order_id).delete()
+
+
+def sync_customer(customer):
+    DashboardOrderRow.objects.filter(customer_id=customer.pk).exclude(
+        customer_name=customer.name, user_profile_id=customer.user_profile_id,
+    ).update(customer_name=customer.name, user_profile_id=customer.user_profile_id, updated_at=timezone.now())
+
+
+def reassign_customers(customer_ids, customer):
+    DashboardOrderRow.objects.filter(customer_id__in=customer_ids).update(
+        customer_id=customer.pk, customer_name=customer.name, user_profile_id=customer.user_profile_id,
+        updated_at=timezone.now())
+
+
+def sync_product(product):
+    DashboardOrderRow.objects.filter(product_id=product.pk).exclude(
+        product_name=product.name,
+    ).update(product_name=product.name, updated_at=timezone.now())
+
+
+def detach_customer(customer_id):
+    DashboardOrderRow.objects.filter(customer_id=customer_id).update(
+        customer_id=None, customer_name=None, user_profile_id=None, updated_at=timezone.now())
+
+
+def detach_product(product_id):
+    DashboardOrderRow.objects.filter(product_id=product_id).update(
+        product_id=None, product_name=None, updated_at=timezone.now())
@@ -0,0 +1,189 @@
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections
+from . import metrics
+from .catalog import TwoTierCache
+from .models import Profile, Customer, Order, ShardAssignment
+
+
+# Customers and orders live on the shard of their sales rep's profile. Every
+# other model (profiles, products, users, audit log, dashboard rows, the shard
+# map itself) stays on the default database.
+SHARDED_MODELS = (Customer, Order)
+
+# Each shard allocates primary keys from its own range, so rows keep their ids
+# when a profile is moved and ids stay unique across shards
+SHARD_ID_SPACE = 2 ** 40
+
+_local = threading.local()
+
+# Profile -> shard lookups. The cache must be shared by every worker (checked by
+# sales.checks) and entries expire quickly, so a missed invalidation cannot
+# route a rep to the shard they were moved away from for long.
+shard_map = TwoTierCache(
+    'shardmap',
+    alias=getattr(settings, 'SHARD_MAP_CACHE_ALIAS', 'default'),
+    max_entries=1024,
+    timeout=getattr(settings, 'SHARD_MAP_TIMEOUT', 60),
+)
+
+
+def shards():
+    return settings.SALES_SHARDS
+
+
+def _assigned_shard(profile_id):
+    # New profiles are placed by hash once and then pinned, so adding shards
+    # later never moves existing data implicitly
+    assignment, created = ShardAssignment.objects.get_or_create(
+        profile_id=profile_id,
+        defaults={'alias': shards()[profile_id % len(shards())]},
+    )
+    return assignment.alias
+
+
+def shard_for_profile(profile_id):
+    if len(shards()) == 1 or profile_id is None:
+        return shards()[0]
+    return shard_map.get('profile:%d' % profile_id, lambda: _assigned_shard(profile_id))
+
+
+def current_shard():
+    if len(shards()) == 1:
+        return shards()[0]
+    alias = getattr(_local, 'alias', None)
+    if alias is None:
+        get_profile_id = getattr(_local, 'get_profile_id', None)
+        profile_id = get_profile_id() if get_profile_id is not None else None
+        alias = shard_for_profile(profile_id)
+        if get_profile_id is not None:
+            _local.alias = alias
+    return alias
+
+
+@contextmanager
+def use_shard(alias=None, get_profile_id=None):
+    # Route unhinted customer and order queries to `alias`, or to the shard of
+    # the profile returned by get_profile_id (resolved on first use)
+    previous = getattr(_local, 'alias', None), getattr(_local, 'get_profile_id', None)
+    _local.alias = alias
+    _local.get_profile_id = get_profile_id
+    try:
+        yield
+    finally:
+        _local.alias, _local.get_profile_id = previous
+
+
+class ShardRouter:
+    def _shard_for_instance(self, instance):
+        if isinstance(instance, SHARDED_MODELS):
+            if instance._state.db:
+                return instance._state.db
+            if isinstance(instance, Customer):
+                return shard_for_profile(instance.user_profile_id)
+            if Order.customer.is_cached(instance) and instance.customer is not None:
+                return self._shard_for_instance(instance.customer)
+        elif isinstance(instance, Profile):
+            return shard_for_profile(instance.pk)
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        if model not in SHARDED_MODELS:
+            return 'default'
+        instance = hints.get('instance')
+        if instance is not None:
+            return self._shard_for_instance(instance)
+        return current_shard()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not isinstance(obj1, SHARDED_MODELS) or not isinstance(obj2, SHARDED_MODELS):
+            return True
+        return obj1._state.db == obj2._state.db
+
+
+def reset_id_sequence(alias):
+    # Point the customer and order id sequences of a shard at the top of its
+    # own range. Rows copied in from another shard keep their ids, which must
+    # not drag the sequence into that shard's range.
+    if alias not in shards():
+        return
+    start = shards().index(alias) * SHARD_ID_SPACE
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in SHARDED_MODELS:
+            table = connection.ops.quote_name(model._meta.db_table)
+            cursor.execute('SELECT MAX(id) FROM ' + table + ' WHERE id >= %s AND id < %s',
+                           [start, start + SHARD_ID_SPACE])
+            value = max(cursor.fetchone()[0] or 0, start)
+            if connection.vendor == 'sqlite':
+                cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [model._meta.db_table])
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                               [model._meta.db_table, value])
+            elif connection.vendor == 'postgresql' and value:
+                cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", [model._meta.db_table, value])
+
+
+def scatter_gather(func):
+    # Run func(alias) on every shard in parallel and return the results in shard order
+    if len(shards()) == 1:
+        return [func(shards()[0])]
+
+    # The request's SQL timing wrapper only sees its own thread's connections,
+    # so each worker times its queries and the totals are added to the request
+    # afterwards. Shards run in parallel, so the SQL time can exceed the total.
+    timings = metrics.current()
+
+    def run(alias):
+        worker_timings = metrics.start_request() if timings is not None else None
+        try:
+            with ExitStack() as stack:
+                if worker_timings is not None:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(worker_timings))
+                return func(alias), worker_timings
+        finally:
+            metrics.end_request()
+            # Worker threads open their own connections; don't leak them
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(shards())) as executor:
+        results = list(executor.map(run, shards()))
+    if timings is not None:
+        for _, worker_timings in results:
+            timings.add(worker_timings)
+    return [result for result, _ in results]
+
+
+def other_shards(alias):
+    return [shard for shard in shards() if shard != alias]
+
+
+class ShardedList:
+    # Sliceable view of a customer or order queryset over every shard, newest
+    # id first, that Paginator can page through. A page ending at row N reads
+    # at most N rows per shard and merges them.
+    def __init__(self, queryset):
+        self.queryset = queryset.order_by('-id')
+
+    def per_shard(self):
+        return [self.queryset.using(alias) for alias in shards()]
+
+    def count(self):
+        return sum(scatter_gather(lambda alias: self.queryset.using(alias).count()))
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        rows = scatter_gather(lambda alias: list(self.queryset.using(alias)[:index.stop]))
+        merged = heapq.merge(*rows, key=lambda obj: obj.pk, reverse=True)
+        return list(islice(merged, index.start, index.stop))
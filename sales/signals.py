@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_init, post_delete, post_migrate
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from .models import Profile, Customer, Product, Order, ShardAssignment
+from . import audit, readmodels, sharding
+from .catalog import catalog_cache
 
 
 @receiver(post_save, sender=User)
@@ -11,3 +14,102 @@ def profile_create(sender, instance, created, **kwargs):
             user=instance,
             username=instance.username
         )
+
+
+# Audit log
+@receiver(post_init, sender=Customer)
+@receiver(post_init, sender=Product)
+@receiver(post_init, sender=Order)
+def audit_snapshot(sender, instance, **kwargs):
+    instance._audit_snapshot = audit.snapshot(instance)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Order)
+def audit_save(sender, instance, created, using, **kwargs):
+    current = audit.snapshot(instance)
+    if created:
+        changes = {name: value for name, value in current.items() if value not in (None, '')}
+        audit.record(instance, 'create', changes, using=using)
+    else:
+        changes = audit.diff(instance._audit_snapshot, current)
+        if changes:
+            audit.record(instance, 'update', changes, using=using)
+    instance._audit_snapshot = current
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Order)
+def audit_delete(sender, instance, using, **kwargs):
+    audit.record(instance, 'delete', {}, using=using)
+
+
+# Product catalog cache
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def catalog_invalidate(sender, using, **kwargs):
+    # After commit, so no worker can cache the old rows again under the new stamp
+    transaction.on_commit(catalog_cache.invalidate, using=using)
+
+
+# Dashboard read model
+@receiver(post_save, sender=Order)
+def dashboard_order_save(sender, instance, **kwargs):
+    readmodels.sync_order(instance)
+
+
+@receiver(post_save, sender=Customer)
+def dashboard_customer_save(sender, instance, created, **kwargs):
+    if not created:
+        readmodels.sync_customer(instance)
+
+
+@receiver(post_save, sender=Product)
+def dashboard_product_save(sender, instance, created, **kwargs):
+    if not created:
+        readmodels.sync_product(instance)
+
+
+@receiver(post_delete, sender=Order)
+def dashboard_order_delete(sender, instance, **kwargs):
+    readmodels.remove_order(instance.pk)
+
+
+@receiver(post_delete, sender=Customer)
+def dashboard_customer_delete(sender, instance, **kwargs):
+    readmodels.detach_customer(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def dashboard_product_delete(sender, instance, **kwargs):
+    readmodels.detach_product(instance.pk)
+
+
+# Sharding
+@receiver(post_migrate)
+def shard_reset_id_sequence(sender, using, **kwargs):
+    if sender.name == 'sales':
+        sharding.reset_id_sequence(using)
+
+
+@receiver(post_save, sender=ShardAssignment)
+@receiver(post_delete, sender=ShardAssignment)
+def shard_map_invalidate(sender, using, **kwargs):
+    # After commit, so no worker can cache the old assignment under the new stamp
+    transaction.on_commit(sharding.shard_map.invalidate, using=using)
+
+
+# The delete collector only sees related rows on the database the deleted
+# object lives on; null the references held on the other shards
+@receiver(post_delete, sender=Profile)
+def shard_profile_delete(sender, instance, using, **kwargs):
+    for alias in sharding.other_shards(using):
+        Customer.objects.using(alias).filter(user_profile_id=instance.pk).update(user_profile=None)
+
+
+@receiver(post_delete, sender=Product)
+def shard_product_delete(sender, instance, using, **kwargs):
+    for alias in sharding.other_shards(using):
+        Order.objects.using(alias).filter(product_id=instance.pk).update(product=None)
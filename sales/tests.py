@@ -1,3 +1,866 @@
-from django.test import TestCase
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import ExitStack
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import Client, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import alerts, checks, dedup, metrics, profiler, sharding
+from .catalog import TwoTierCache, catalog_cache
+from .filters import OrderFilter, ProductFilter
+from .models import AuditLog, Customer, DashboardOrderRow, Order, Product, ShardAssignment, StockAlert
+
+
+def _catalog_worker(connection, source):
+    cache = TwoTierCache('catalog-test', alias='catalog')
+    while True:
+        command = connection.recv()
+        if command == 'stop':
+            break
+        connection.send(cache.get('choices', lambda: source.value))
+
+
+@skipUnless('fork' in multiprocessing.get_all_start_methods(), 'requires fork')
+class CatalogCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        settings_override = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'catalog': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.location,
+            },
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = TwoTierCache('catalog-test', alias='catalog', max_entries=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 1)
+        cache.get('c', lambda: 3)
+        self.assertEqual(list(cache._entries), ['a', 'c'])
+        self.assertEqual(cache.stats['eviction'], 1)
+        self.assertEqual(cache.stats['local_hit'], 1)
+
+    def test_version_is_checked_once_per_interval(self):
+        cache = TwoTierCache('catalog-test', alias='catalog', check_interval=60)
+        with mock.patch('sales.catalog.time.monotonic', return_value=1000):
+            cache.get('a', lambda: 1)
+            TwoTierCache('catalog-test', alias='catalog').invalidate()
+            self.assertEqual(cache.get('a', lambda: 2), 1)
+        with mock.patch('sales.catalog.time.monotonic', return_value=1060):
+            self.assertEqual(cache.get('a', lambda: 2), 2)
+
+    def test_catalog_cache_must_be_shared(self):
+        self.assertEqual([error.id for error in checks.check_catalog_cache(None)], ['sales.W001'])
+        with override_settings(CATALOG_CACHE_ALIAS='catalog', CATALOG_CACHE_TIMEOUT=None):
+            self.assertEqual(checks.check_catalog_cache(None), [])
+        with override_settings(CATALOG_CACHE_TIMEOUT=None):
+            self.assertEqual([error.id for error in checks.check_catalog_cache(None)], ['sales.E001'])
+
+    def test_invalidation_is_coherent_across_processes(self):
+        context = multiprocessing.get_context('fork')
+        source = context.Value('i', 1)
+        workers = []
+        for _ in range(3):
+            parent, child = context.Pipe()
+            process = context.Process(target=_catalog_worker, args=(child, source))
+            process.start()
+            workers.append((process, parent))
+
+        def read_all():
+            for process, connection in workers:
+                connection.send('get')
+            return [connection.recv() for process, connection in workers]
+
+        try:
+            self.assertEqual(read_all(), [1, 1, 1])
+            # Every worker now holds the value in its own LRU
+            source.value = 2
+            self.assertEqual(read_all(), [1, 1, 1])
+
+            TwoTierCache('catalog-test', alias='catalog').invalidate()
+            self.assertEqual(read_all(), [2, 2, 2])
+        finally:
+            for process, connection in workers:
+                connection.send('stop')
+                process.join(5)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class OrderPriceTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        user = User.objects.create_user('rep', password='secret')
+        ShardAssignment.objects.create(profile=user.profile, alias=settings.SALES_SHARDS[0])
+        self.client = Client()
+        self.client.force_login(user)
+        self.product = Product.objects.create(name='Widget', price=10, inventory=100)
+        self.customer = Customer(user_profile=user.profile, name='Alice')
+        self.customer.save()
+
+    def add_order(self, quantity, product=None):
+        order = Order(customer=self.customer, product=product or self.product, quantity=quantity, status='Pending')
+        order.save()
+        return order
+
+    def revenue(self):
+        data = self.client.get('/data/').json()
+        detail = self.client.get('/customer/%d/' % self.customer.pk)
+        return ([Decimal(item['daily_sales']) for item in data['data_1']],
+                [Decimal(item['sales_sum']) for item in data['data_2']],
+                detail.context['total_price_sum'])
+
+    def test_price_change_keeps_past_revenue(self):
+        self.add_order(3)
+        before = self.revenue()
+        self.assertEqual(before, ([30], [30], 30))
+
+        self.product.price = 25
+        self.product.save()
+        self.assertEqual(self.revenue(), before)
+        # New orders use the new price
+        self.assertEqual(self.add_order(1).line_total, 25)
+
+    def test_switching_product_takes_a_new_snapshot(self):
+        order = self.add_order(2)
+        gadget = Product.objects.create(name='Gadget', price=4, inventory=100)
+
+        order = Order.objects.get(pk=order.pk)
+        order.product = gadget
+        order.save()
+        order.refresh_from_db()
+        self.assertEqual((order.unit_price, order.line_total), (4, 8))
+
+        # Other edits keep the snapshot
+        gadget.price = 5
+        gadget.save()
+        order = Order.objects.get(pk=order.pk)
+        order.quantity = 3
+        order.save()
+        self.assertEqual((order.unit_price, order.line_total), (4, 12))
+
+    def test_backfill_order_totals(self):
+        first = self.add_order(2)
+        second = self.add_order(1)
+        Order.objects.update(unit_price=None, line_total=None)
+
+        call_command('backfill_order_totals', batch_size=1, stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(sorted(Order.objects.values_list('pk', 'unit_price', 'line_total')),
+                         [(first.pk, 10, 20), (second.pk, 10, 10)])
+
+
+class DashboardRowTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.profile = User.objects.create_user('rep', password='secret').profile
+        ShardAssignment.objects.create(profile=self.profile, alias=settings.SALES_SHARDS[0])
+        self.product = Product.objects.create(name='Widget', price=10, inventory=100)
+        self.customer = self.add_customer('Alice')
+
+    def add_customer(self, name):
+        customer = Customer(user_profile=self.profile, name=name)
+        customer.save()
+        return customer
+
+    def add_order(self, customer, quantity):
+        order = Order(customer=customer, product=self.product, quantity=quantity, status='Pending')
+        order.save()
+        return order
+
+    def rows(self):
+        return list(DashboardOrderRow.objects.order_by('order_id').values_list(
+            'order_id', 'customer_id', 'customer_name', 'product_name', 'quantity', 'line_total', 'status'))
+
+    def test_rows_follow_orders(self):
+        order = self.add_order(self.customer, 2)
+        self.assertEqual(self.rows(), [(order.pk, self.customer.pk, 'Alice', 'Widget', 2, 20, 'Pending')])
+
+        order.status = 'Shipped'
+        order.save()
+        self.assertEqual(self.rows()[0][-1], 'Shipped')
+
+        order.delete()
+        self.assertEqual(self.rows(), [])
+
+    def test_rows_follow_customers_and_products(self):
+        order = self.add_order(self.customer, 1)
+        self.customer.name = 'Alicia'
+        self.customer.save()
+        self.product.name = 'Gizmo'
+        self.product.save()
+        self.assertEqual(self.rows(), [(order.pk, self.customer.pk, 'Alicia', 'Gizmo', 1, 10, 'Pending')])
+
+        self.product.delete()
+        self.customer.delete()
+        self.assertEqual(self.rows(), [(order.pk, None, None, None, 1, 10, 'Pending')])
+
+    def test_rows_follow_merges(self):
+        duplicate = self.add_customer('Alice S')
+        order = self.add_order(duplicate, 1)
+        dedup.merge_customers(self.customer, [duplicate])
+        self.assertEqual(self.rows(), [(order.pk, self.customer.pk, 'Alice', 'Widget', 1, 10, 'Pending')])
+
+    def test_rebuild_and_backfill(self):
+        first = self.add_order(self.customer, 2)
+        second = self.add_order(self.customer, 3)
+        expected = self.rows()
+        DashboardOrderRow.objects.all().delete()
+
+        call_command('rebuild_dashboard', batch_size=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.rows(), expected)
+
+        # Totals filled by the backfill reach the dashboard too
+        Order.objects.update(unit_price=None, line_total=None)
+        DashboardOrderRow.objects.update(line_total=None)
+        call_command('backfill_order_totals', stdout=open(os.devnull, 'w'))
+        self.assertEqual([row[-2] for row in self.rows()], [20, 30])
+        self.assertEqual([row[0] for row in self.rows()], [first.pk, second.pk])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ProductFacetTests(TransactionTestCase):
+    def setUp(self):
+        for name, price, inventory in [('A', 5, 1), ('B', 20, 0), ('C', 30, 2), ('D', 150, 3)]:
+            Product.objects.create(name=name, price=price, inventory=inventory)
+
+    def facets(self, data):
+        facets = ProductFilter(data, queryset=Product.objects.all()).facets()
+        return (facets['total'],
+                [option['count'] for option in facets['stock']],
+                [option['count'] for option in facets['price_bands']])
+
+    def test_counts_per_stock_and_price_band(self):
+        # Stock: In Stock, Out of Stock; bands: <10, 10-50, 50-100, 100+
+        self.assertEqual(self.facets({}), (4, [3, 1], [1, 2, 0, 1]))
+        self.assertEqual(self.facets({'name': 'c'}), (1, [1, 0], [0, 1, 0, 0]))
+
+    def test_each_facet_ignores_its_own_selection(self):
+        self.assertEqual(self.facets({'stock': 'In Stock'}), (3, [3, 1], [1, 1, 0, 1]))
+        self.assertEqual(self.facets({'price_band': '1'}), (2, [1, 1], [1, 2, 0, 1]))
+        self.assertEqual(self.facets({'stock': 'In Stock', 'price_band': '1'}), (1, [1, 1], [1, 1, 0, 1]))
+
+        facets = ProductFilter({'stock': 'In Stock'}, queryset=Product.objects.all()).facets()
+        self.assertEqual([option['selected'] for option in facets['stock']], [True, False])
+        # Clicking the selected option clears it
+        self.assertEqual(facets['stock'][0]['query'], '')
+
+    def test_page_count_comes_from_the_facets(self):
+        client = Client()
+        client.force_login(User.objects.create_user('rep', password='secret'))
+        facet_counts = ProductFilter.facet_counts
+
+        def inflated(self):
+            return dict(facet_counts(self), total=42)
+
+        with mock.patch.object(ProductFilter, 'facet_counts', inflated):
+            response = client.get('/product/?stock=In+Stock')
+        self.assertEqual(response.context['product_list'].paginator.count, 42)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class OrderFacetTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('rep', password='secret')
+        ShardAssignment.objects.create(profile=self.user.profile, alias=settings.SALES_SHARDS[0])
+        self.widget, self.gadget, self.gizmo = [
+            Product.objects.create(name=name, price=10, inventory=100) for name in ['Widget', 'Gadget', 'Gizmo']]
+        self.customer = Customer(user_profile=self.user.profile, name='Alice')
+        self.customer.save()
+        for product, status in [(self.widget, 'Pending'), (self.widget, 'Pending'),
+                                (self.widget, 'Shipped'), (self.gadget, 'Pending')]:
+            Order(customer=self.customer, product=product, quantity=1, status=status).save()
+        other = Customer(user_profile=self.user.profile, name='Bob')
+        other.save()
+        Order(customer=other, product=self.gizmo, quantity=1, status='Pending').save()
+
+    def facets(self, data):
+        order_filter = OrderFilter(data, queryset=self.customer.order_set.all())
+        facets = order_filter.facets({self.widget.pk: 'Widget', self.gadget.pk: 'Gadget'})
+        return (facets['total'],
+                {option['label']: option['count'] for option in facets['status'] if option['count']},
+                {option['label']: option['count'] for option in facets['product']})
+
+    def test_product_choices_are_the_customers_products(self):
+        order_filter = OrderFilter({}, queryset=self.customer.order_set.all())
+        self.assertEqual(set(order_filter.filters['product'].queryset), {self.widget, self.gadget})
+
+    def test_counts_under_a_filter(self):
+        self.assertEqual(self.facets({}), (4, {'Pending': 3, 'Shipped': 1}, {'Widget': 3, 'Gadget': 1}))
+        # Each facet ignores its own selection
+        self.assertEqual(self.facets({'status': 'Pending'}),
+                         (3, {'Pending': 3, 'Shipped': 1}, {'Widget': 2, 'Gadget': 1}))
+        self.assertEqual(self.facets({'product': self.widget.pk}),
+                         (3, {'Pending': 2, 'Shipped': 1}, {'Widget': 3, 'Gadget': 1}))
+        self.assertEqual(self.facets({'product': self.widget.pk, 'status': 'Shipped'}),
+                         (1, {'Pending': 2, 'Shipped': 1}, {'Widget': 1}))
+
+    def test_page_count_comes_from_the_facets(self):
+        client = Client()
+        client.force_login(self.user)
+        facets = OrderFilter.facets
+
+        def inflated(self, product_names):
+            return dict(facets(self, product_names), total=42)
+
+        with mock.patch.object(OrderFilter, 'facets', inflated):
+            response = client.get('/customer/%d/?status=Pending' % self.customer.pk)
+        self.assertEqual(response.context['order_list'].paginator.count, 42)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class CatalogInvalidationTests(TransactionTestCase):
+    def test_invalidated_after_commit(self):
+        version = catalog_cache.current_version()
+        with transaction.atomic():
+            Product.objects.create(name='Widget', price=10, inventory=100)
+            self.assertEqual(catalog_cache.current_version(), version)
+        self.assertNotEqual(catalog_cache.current_version(), version)
+
+    def test_product_page_tag_follows_the_rendered_catalog(self):
+        client = Client()
+        client.force_login(User.objects.create_user('rep', password='secret'))
+        catalog_cache.invalidate()
+        Product.objects.create(name='Widget', price=10, inventory=100)
+        etag = client.get('/product/')['ETag']
+
+        # Another worker renames the product; this worker has not seen the new
+        # version yet, so it still serves the old page under the old tag
+        Product.objects.update(name='Sprocket')
+        catalog_cache.shared.set(catalog_cache.version_key, 'other-worker', catalog_cache.timeout)
+        with mock.patch.object(catalog_cache, 'check_interval', 60):
+            response = client.get('/product/')
+        self.assertEqual(response['ETag'], etag)
+        self.assertContains(response, 'Widget')
+
+        # Once it has, the old tag no longer matches and the new page is sent
+        with mock.patch.object(catalog_cache, 'check_interval', 0):
+            response = client.get('/product/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Sprocket')
+
+
+class AuditTests(TransactionTestCase):
+    def test_commit_hook_layout(self):
+        # audit._schedule_flush relies on this private layout of commit hooks
+        def hook():
+            pass
+
+        with transaction.atomic():
+            with transaction.atomic():
+                transaction.on_commit(hook)
+                sids, func = connection.run_on_commit[-1][:2]
+        self.assertEqual(len(sids), 1)
+        self.assertIs(func, hook)
+
+    def test_one_insert_per_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Product.objects.create(name='Widget', price=10, inventory=100)
+                try:
+                    with transaction.atomic():
+                        Product.objects.create(name='Gadget', price=5, inventory=100)
+                        raise ValueError
+                except ValueError:
+                    pass
+                Product.objects.create(name='Gizmo', price=2, inventory=100)
+
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "sales_auditlog"')]
+        self.assertEqual(len(inserts), 1)
+        # The rolled back savepoint is not logged
+        self.assertEqual(sorted(AuditLog.objects.values_list('changes__name', flat=True)), ['Gizmo', 'Widget'])
+
+    def test_rolled_back_transaction_is_not_logged(self):
+        try:
+            with transaction.atomic():
+                Product.objects.create(name='Widget', price=10, inventory=100)
+                raise ValueError
+        except ValueError:
+            pass
+        Product.objects.create(name='Gizmo', price=2, inventory=100)
+        self.assertEqual(list(AuditLog.objects.values_list('changes__name', flat=True)), ['Gizmo'])
+
+
+class DedupTests(SimpleTestCase):
+    def test_normalization(self):
+        self.assertEqual(dedup.normalize_email(' J.Smith+crm@GoogleMail.com '), 'jsmith@gmail.com')
+        self.assertEqual(dedup.normalize_email('j.smith@example.com'), 'j.smith@example.com')
+        self.assertIsNone(dedup.normalize_email('not-an-email'))
+        self.assertEqual(dedup.normalize_phone('+1 (555) 123-4567'), '15551234567')
+        self.assertIsNone(dedup.normalize_phone('555-12'))
+        self.assertEqual(dedup.normalize_name('Smith, José'), 'jose smith')
+        self.assertEqual(dedup.normalize_name('jose  SMITH'), 'jose smith')
+        self.assertIsNone(dedup.normalize_name(' - '))
+
+    def test_score(self):
+        first = dedup.blocking_keys('John Smith', '555-123-4567', 'john@example.com')
+        self.assertEqual(dedup.score(first, first), (1.2, ['email', 'phone', 'name']))
+        second = dedup.blocking_keys('John Smithers', '5551234567', '')
+        # Phone plus one of three name tokens
+        self.assertEqual(dedup.score(first, second), (0.5, ['phone', 'name']))
+        third = dedup.blocking_keys('Jane Doe', '', '')
+        self.assertEqual(dedup.score(first, third), (0.0, []))
+
+
+class DedupMergeTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.profile = self.make_profile('rep')
+        self.product = Product.objects.create(name='Widget', price=10, inventory=100)
+
+    def make_profile(self, username):
+        # Every rep on the first shard, where unhinted queries go
+        profile = User.objects.create_user(username, password='secret').profile
+        ShardAssignment.objects.create(profile=profile, alias=settings.SALES_SHARDS[0])
+        return profile
+
+    def add_customer(self, name, orders=0, **fields):
+        customer = Customer(user_profile=self.profile, name=name, **fields)
+        customer.save()
+        for _ in range(orders):
+            Order(customer=customer, product=self.product, quantity=1, status='Pending').save()
+        return customer
+
+    def test_find_duplicates(self):
+        first = self.add_customer('John Smith', email='john@example.com')
+        second = self.add_customer('Smith, John', email='John+crm@example.com')
+        self.add_customer('Jane Doe', email='jane@example.com')
+
+        matches = dedup.find_duplicates(Customer.objects.all(), threshold=0.5)
+        self.assertEqual([(match.customer, match.duplicate) for match in matches], [(first, second)])
+        self.assertEqual(matches[0].reasons, ['email', 'name'])
+
+    def test_merge_moves_orders_and_is_audited(self):
+        customer = self.add_customer('John Smith', orders=1)
+        duplicate = self.add_customer('John Smith', orders=2, phone='555-123-4567')
+        moved = sorted(duplicate.order_set.values_list('id', flat=True))
+
+        self.assertEqual(dedup.merge_customers(customer, [duplicate]), 1)
+
+        customer.refresh_from_db()
+        self.assertEqual(customer.phone, '555-123-4567')
+        self.assertEqual(customer.order_set.count(), 3)
+        self.assertFalse(Customer.objects.filter(pk=duplicate.pk).exists())
+        entry = AuditLog.objects.get(action='merge')
+        self.assertEqual((entry.object_type, entry.object_id), ('customer', duplicate.pk))
+        self.assertEqual(entry.changes, {'merged_into': customer.pk, 'orders': moved})
+
+    def test_merge_pairs_resolves_chains(self):
+        first = self.add_customer('A', orders=1)
+        second = self.add_customer('B', orders=1)
+        third = self.add_customer('C', orders=1)
+        other = self.make_profile('other')
+        foreign = Customer(user_profile=other, name='D')
+        foreign.save()
+
+        # B <- C then A <- B: C ends up in A; D is outside the queryset
+        pairs = [(second.pk, third.pk), (first.pk, second.pk), (first.pk, foreign.pk)]
+        merged = dedup.merge_pairs(Customer.objects.filter(user_profile=self.profile), pairs)
+
+        self.assertEqual(merged, 2)
+        self.assertEqual(list(Customer.objects.values_list('name', flat=True).order_by('name')), ['A', 'D'])
+        self.assertEqual(first.order_set.count(), 3)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StockAlertTests(TransactionTestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Widget', price=10, inventory=5, reorder_threshold=10)
+
+    def restock(self, inventory):
+        self.product.inventory = inventory
+        self.product.save()
+        return alerts.evaluate([self.product])
+
+    def test_alert_opens_once_until_restocked(self):
+        received = []
+
+        def handler(sender, alert, **kwargs):
+            received.append(alert)
+
+        alerts.low_stock.connect(handler)
+        self.addCleanup(alerts.low_stock.disconnect, handler)
+
+        opened = alerts.evaluate([self.product])
+        self.assertEqual(received, opened)
+        self.assertEqual((opened[0].inventory, opened[0].threshold), (5, 10))
+        # Still low: no second alert
+        self.assertEqual(self.restock(3), [])
+        self.assertEqual(StockAlert.objects.open().count(), 1)
+        with self.assertRaises(IntegrityError):
+            StockAlert.objects.create(product=self.product, inventory=3, threshold=10)
+
+        self.assertEqual(self.restock(50), [])
+        self.assertFalse(StockAlert.objects.open().exists())
+        self.assertIsNotNone(StockAlert.objects.get().resolved_at)
+
+        # Dropping again opens a new alert
+        self.assertEqual(len(self.restock(10)), 1)
+        self.assertEqual(StockAlert.objects.count(), 2)
+        self.assertEqual([alert.product for alert in alerts.reorder_queue()], [self.product])
+
+    def test_product_page_validator_covers_alerts(self):
+        alerts.evaluate([self.product])
+        client = Client()
+        client.force_login(User.objects.create_user('rep', password='secret'))
+        etag = client.get('/product/')['ETag']
+        self.assertEqual(client.get('/product/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Resolved without touching the product, e.g. from the admin
+        StockAlert.objects.update(resolved_at=self.product.updated_at)
+        self.assertEqual(client.get('/product/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class MetricsTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        patcher = mock.patch.object(metrics, 'registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_server_timing_header(self):
+        client = Client()
+        client.force_login(User.objects.create_user('rep', password='secret'))
+        Product.objects.create(name='Widget', price=10, inventory=100)
+        response = client.get('/product/')
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^total;dur=\d+\.\d\d, db;dur=\d+\.\d\d;desc="[1-9]\d* queries", tpl;dur=\d+\.\d\d'
+            r', cache;desc="\d+ hits, \d+ misses"$')
+        self.assertIn('crm_request_duration_seconds_count{route="sales:product"} 1', metrics.render())
+
+    def test_histogram_buckets(self):
+        # COUNT_BUCKETS starts 0, 1, 2, 5; a value on a bound falls in that bucket
+        for value in [0, 3, 5, 1000]:
+            self.registry.observe('crm_db_queries', 'r', value)
+        counts, total, count = self.registry.histograms[('crm_db_queries', 'r')]
+        self.assertEqual(counts, [1, 0, 0, 2, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual((total, count), (1008, 4))
+
+        lines = metrics.render().splitlines()
+        self.assertIn('crm_db_queries_bucket{route="r",le="2"} 1', lines)
+        self.assertIn('crm_db_queries_bucket{route="r",le="5"} 3', lines)
+        self.assertIn('crm_db_queries_bucket{route="r",le="+Inf"} 4', lines)
+        self.assertIn('crm_db_queries_count{route="r"} 4', lines)
+
+    def test_merges_other_workers(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.registry.observe('crm_db_queries', 'r', 1)
+        self.registry.inc('crm_cache_hits_total', 'r', 2)
+        other = metrics.Registry()
+        other.observe('crm_db_queries', 'r', 1)
+        other.inc('crm_cache_hits_total', 'r', 3)
+        with open(os.path.join(directory, 'metrics-0.json'), 'w') as f:
+            json.dump(other.snapshot(), f)
+        # Unreadable and unrelated files are skipped
+        with open(os.path.join(directory, 'metrics-1.json'), 'w') as f:
+            f.write('{')
+        with open(os.path.join(directory, 'notes.txt'), 'w') as f:
+            f.write('x')
+
+        with override_settings(METRICS_DIR=directory):
+            lines = metrics.render().splitlines()
+        self.assertIn('crm_db_queries_count{route="r"} 2', lines)
+        self.assertIn('crm_cache_hits_total{route="r"} 5', lines)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_requires_staff_or_token(self):
+        client = Client()
+        self.assertEqual(client.get('/metrics/').status_code, 403)
+        self.assertEqual(client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+
+        client.force_login(User.objects.create_user('rep', password='secret'))
+        self.assertEqual(client.get('/metrics/').status_code, 403)
+        client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        response = client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '# TYPE crm_request_duration_seconds histogram')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ProfilerTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(PROFILER_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_client(self, username, is_staff=False):
+        client = Client()
+        client.force_login(User.objects.create_user(username, password='secret', is_staff=is_staff))
+        return client
+
+    def test_token(self):
+        token = profiler.make_token()
+        self.assertTrue(profiler.check_token(token))
+        self.assertFalse(profiler.check_token(token + 'x'))
+        self.assertFalse(profiler.check_token('profile'))
+        expired = time.time() + settings.PROFILER_TOKEN_MAX_AGE + 1
+        with mock.patch('time.time', return_value=expired):
+            self.assertFalse(profiler.check_token(token))
+
+    def test_captures_requested_with_a_token_or_by_staff(self):
+        response = Client().get('/login/', HTTP_X_PROFILE_TOKEN=profiler.make_token())
+        self.assertTrue(response.has_header('X-Profile-Capture'))
+        self.assertFalse(Client().get('/login/', HTTP_X_PROFILE_TOKEN='bad').has_header('X-Profile-Capture'))
+        self.assertFalse(Client().get('/login/').has_header('X-Profile-Capture'))
+
+        self.assertTrue(self.make_client('staff', is_staff=True).get('/?_profile=1').has_header('X-Profile-Capture'))
+        self.assertFalse(self.make_client('rep').get('/?_profile=1').has_header('X-Profile-Capture'))
+
+    def test_capture_path_only_serves_captures(self):
+        name = profiler.save(profiler.Capture(), 'sales:index', 0.1)
+        with open(os.path.join(self.directory, 'notes.txt'), 'w') as f:
+            f.write('x')
+        self.assertEqual(profiler.capture_path(name + '.collapsed.txt'),
+                         os.path.join(self.directory, name + '.collapsed.txt'))
+        for filename in ['notes.txt', '../' + name + '.collapsed.txt', name, os.path.join(self.directory, 'notes.txt')]:
+            with self.subTest(filename=filename):
+                self.assertIsNone(profiler.capture_path(filename))
+
+    def test_capture_views_are_staff_only(self):
+        name = profiler.save(profiler.Capture(), 'sales:index', 0.1) + '.speedscope.json'
+        for client in [Client(), self.make_client('rep')]:
+            self.assertEqual(client.get('/profiles/').status_code, 302)
+            self.assertEqual(client.get('/profiles/%s/' % name).status_code, 302)
+
+        client = self.make_client('staff', is_staff=True)
+        response = client.get('/profiles/')
+        self.assertEqual([capture['name'] for capture in response.context['capture_list']],
+                         [name, name.replace('.speedscope.json', '.collapsed.txt')])
+        response = client.get('/profiles/%s/' % name)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['name'], 'sales:index')
+        self.assertEqual(client.get('/profiles/notes.txt/').status_code, 404)
+
+
+class APITests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        user = User.objects.create_user('rep', password='secret')
+        ShardAssignment.objects.create(profile=user.profile, alias=settings.SALES_SHARDS[0])
+        self.client = Client()
+        self.client.force_login(user)
+        self.products = [Product.objects.create(name=name, price=10, inventory=100) for name in 'ABC']
+        self.customers = []
+        for name in ['Alice', 'Bob']:
+            customer = Customer(user_profile=user.profile, name=name)
+            customer.save()
+            self.customers.append(customer)
+
+    def add_orders(self, count):
+        orders = []
+        for i in range(count):
+            order = Order(customer=self.customers[i % 2], product=self.products[i % 3], quantity=1, status='Pending')
+            order.save()
+            orders.append(order)
+        return orders
+
+    def count_queries(self, path):
+        with ExitStack() as stack:
+            captures = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            self.assertEqual(self.client.get(path).status_code, 200)
+        return sum(len(capture) for capture in captures)
+
+    def test_requires_login(self):
+        response = Client().get('/api/products/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Authentication required'})
+
+    def test_fields_and_include(self):
+        order, = self.add_orders(1)
+        data = self.client.get('/api/orders/?fields=quantity&include=customer,product').json()['data']
+        self.assertEqual(data, [{
+            'id': order.pk,
+            'quantity': 1,
+            'customer': {'id': self.customers[0].pk, 'name': 'Alice'},
+            'product': {'id': self.products[0].pk, 'name': 'A', 'price': '10.00'},
+        }])
+        # Foreign keys asked for explicitly are kept next to the included row
+        row = self.client.get('/api/orders/?fields=customer_id&include=customer').json()['data'][0]
+        self.assertEqual(row['customer_id'], self.customers[0].pk)
+
+    def test_cursor_paging(self):
+        orders = self.add_orders(5)
+        ids, path = [], '/api/orders/?fields=id&limit=2'
+        while path:
+            body = self.client.get(path).json()
+            self.assertLessEqual(len(body['data']), 2)
+            ids += [row['id'] for row in body['data']]
+            path = body['next_cursor'] and '/api/orders/?fields=id&limit=2&cursor=' + body['next_cursor']
+        self.assertEqual(ids, sorted((order.pk for order in orders), reverse=True))
+
+    def test_ids(self):
+        orders = self.add_orders(3)
+        body = self.client.get('/api/orders/?ids=%d,%d' % (orders[0].pk, orders[2].pk)).json()
+        self.assertEqual([row['id'] for row in body['data']], [orders[2].pk, orders[0].pk])
+        self.assertIsNone(body['next_cursor'])
+
+    def test_bad_requests(self):
+        too_many = ','.join(str(i) for i in range(1, 102))
+        for query in ['fields=nope', 'include=nope', 'ids=1,x', 'ids=' + too_many,
+                      'limit=x', 'limit=0', 'cursor=!!!']:
+            with self.subTest(query=query):
+                response = self.client.get('/api/orders/?' + query)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_not_modified(self):
+        response = self.client.get('/api/products/')
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.products[0].inventory = 7
+        self.products[0].save()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Profiles have no updated_at, so listings including them are not tagged
+        self.assertFalse(self.client.get('/api/customers/?include=user_profile').has_header('ETag'))
+
+    def test_queries_do_not_grow_with_the_page(self):
+        self.add_orders(30)
+        path = '/api/orders/?include=customer,product&limit=%d'
+        self.assertEqual(self.count_queries(path % 5), self.count_queries(path % 25))
+
+
+@skipUnless(len(settings.SALES_SHARDS) > 1, 'run with --settings=django_app.settings_sharded')
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ShardingTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        sharding.shard_map.invalidate()
+        self.product = Product.objects.create(name='Widget', price=10, inventory=100)
+
+    def make_rep(self, username, alias):
+        user = User.objects.create_user(username, password='secret')
+        ShardAssignment.objects.create(profile=user.profile, alias=alias)
+        client = Client()
+        client.force_login(user)
+        return user.profile, client
+
+    def add_order(self, profile, name, quantity):
+        customer = Customer(user_profile=profile, name=name)
+        customer.save()
+        order = Order(customer=customer, product=self.product, quantity=quantity, status='Pending')
+        order.save()
+        return customer, order
+
+    def test_customers_and_orders_follow_their_profile(self):
+        first, _ = self.make_rep('first', 'shard_1')
+        second, _ = self.make_rep('second', 'shard_2')
+        customer_1, order_1 = self.add_order(first, 'Alice', 1)
+        customer_2, order_2 = self.add_order(second, 'Bob', 2)
+
+        self.assertEqual(customer_1._state.db, 'shard_1')
+        self.assertEqual(order_1._state.db, 'shard_1')
+        self.assertEqual(Customer.objects.using('shard_2').get().name, 'Bob')
+        self.assertFalse(Customer.objects.using('default').exists())
+        # Every shard allocates ids from its own range
+        self.assertNotEqual(customer_1.pk, customer_2.pk)
+        self.assertNotEqual(order_1.pk, order_2.pk)
+
+    def test_views_read_the_reps_shard(self):
+        first, client = self.make_rep('first', 'shard_1')
+        second, _ = self.make_rep('second', 'shard_2')
+        customer, _ = self.add_order(first, 'Alice', 3)
+        other, _ = self.add_order(second, 'Bob', 4)
+
+        response = client.get('/customer/%d/' % customer.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['num_of_order'], 1)
+        # Another rep's customer, on another shard
+        self.assertRedirects(client.get('/customer/%d/' % other.pk), '/')
+
+        response = client.get('/api/orders/?include=customer,product')
+        self.assertEqual([row['customer']['name'] for row in response.json()['data']], ['Alice'])
+        self.assertEqual(response.json()['data'][0]['product']['name'], 'Widget')
+
+    def test_dashboard_and_admin_read_every_shard(self):
+        first, client = self.make_rep('first', 'shard_1')
+        second, _ = self.make_rep('second', 'shard_2')
+        alice, _ = self.add_order(first, 'Alice', 3)
+        bob, _ = self.add_order(second, 'Bob', 4)
+
+        response = client.get('/')
+        self.assertEqual([customer.name for customer in response.context['customer_list']], ['Bob', 'Alice'])
+
+        admin = User.objects.create_superuser('admin', password='secret')
+        client.force_login(admin)
+        response = client.get('/admin/sales/customer/?shard=shard_2')
+        self.assertEqual([customer.name for customer in response.context['cl'].result_list], ['Bob'])
+        self.assertEqual(client.get('/admin/sales/customer/%d/change/' % alice.pk).status_code, 200)
+
+    def test_data_view_merges_all_shards(self):
+        first, client = self.make_rep('first', 'shard_1')
+        second, _ = self.make_rep('second', 'shard_2')
+        self.add_order(first, 'Alice', 3)
+        self.add_order(second, 'Bob', 4)
+
+        data = client.get('/data/').json()
+        self.assertEqual([Decimal(item['daily_sales']) for item in data['data_1']], [70])
+        self.assertEqual([item['customer_name'] for item in data['data_2']], ['Bob', 'Alice'])
+        self.assertEqual(data['data_3'], [{'product_name': 'Widget', 'quantity_sum': 7}])
+
+    def test_data_view_times_shard_queries(self):
+        first, client = self.make_rep('first', 'shard_1')
+        self.add_order(first, 'Alice', 3)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/data/')
+        count = int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+        # The three aggregates per shard run on worker threads
+        self.assertEqual(count, len(queries) + 3 * len(settings.SALES_SHARDS))
+
+    def test_shard_map_needs_a_shared_cache(self):
+        self.assertEqual(checks.check_shard_map_cache(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([error.id for error in checks.check_shard_map_cache(None)], ['sales.E002'])
+
+    def test_move_profile_shard(self):
+        profile, client = self.make_rep('first', 'shard_1')
+        customer, order = self.add_order(profile, 'Alice', 3)
+
+        call_command('move_profile_shard', profile.pk, 'shard_2', batch_size=1, stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(sharding.shard_for_profile(profile.pk), 'shard_2')
+        self.assertFalse(Customer.objects.using('shard_1').exists())
+        self.assertFalse(Order.objects.using('shard_1').exists())
+        moved = Order.objects.using('shard_2').select_related('customer').get()
+        self.assertEqual((moved.pk, moved.customer.pk), (order.pk, customer.pk))
+
+        # New rows keep using the target shard's own id range
+        new_customer, _ = self.add_order(profile, 'Carol', 1)
+        self.assertEqual(new_customer._state.db, 'shard_2')
+        self.assertGreaterEqual(new_customer.pk, 2 * sharding.SHARD_ID_SPACE)
+        self.assertEqual(client.get('/customer/%d/' % customer.pk).status_code, 200)
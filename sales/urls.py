@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, api
 
 app_name = 'sales'
 
@@ -10,6 +10,13 @@ urlpatterns = [
     # Data
     path('data/', views.data_view, name='data'),
 
+    # Metrics
+    path('metrics/', views.metrics_view, name='metrics'),
+
+    # Profiler captures
+    path('profiles/', views.profile_capture_list, name='profile-captures'),
+    path('profiles/<str:filename>/', views.profile_capture_download, name='profile-capture-download'),
+
     # User
     path('register/', views.user_register, name='register'),
     path('login/', views.user_login, name='login'),
@@ -22,6 +29,7 @@ urlpatterns = [
 
     # Customer
     path('customer_add/', views.customer_create, name='customer-add'),
+    path('customer_duplicates/', views.customer_duplicates, name='customer-duplicates'),
     path('customer/<int:pk>/', views.customer_view, name='detail'),
     path('customer/<int:pk>/customer_update/', views.customer_update, name='customer-update'),
     path('customer/<int:pk>/customer_delete/', views.customer_delete, name='customer-delete'),
@@ -36,4 +44,9 @@ urlpatterns = [
     path('product_add/', views.product_create, name='product-add'),
     path('product/<int:product_id>/product_update/', views.product_update, name='product-update'),
     path('product/<int:product_id>/product_delete/', views.product_delete, name='product-delete'),
+
+    # API
+    path('api/customers/', api.customer_list, name='api-customers'),
+    path('api/orders/', api.order_list, name='api-orders'),
+    path('api/products/', api.product_list, name='api-products'),
 ]
@@ -1,16 +1,20 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
-from django.http import HttpResponseRedirect, JsonResponse
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth import authenticate, login, logout
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.forms import inlineformset_factory
 from django.core.paginator import Paginator, EmptyPage
 from django.contrib import messages
-from django.db.models import Sum, F
-from .models import Profile, Customer, Order, Product
-from .forms import UserCreationForm, ProfileForm, CustomerForm, ProductForm, OrderForm
+from django.db.models import Count, Q, Sum
+from .models import Profile, Customer, Order, Product, DashboardOrderRow
+from .forms import UserCreationForm, ProfileForm, CustomerForm, ProductForm, OrderForm, OrderLineForm
+from .catalog import CachedProductList, catalog_cache, product_names
 from .filters import OrderFilter, ProductFilter
 from .decorators import unauthenticated_user
+from . import alerts, conditional, dedup, metrics, profiler, sharding
 
 
 # User register
@@ -120,35 +124,58 @@ def profile_update(request, profile_id):
 
 
 # Data
+def _shard_sales(alias):
+    orders = Order.objects.using(alias)
+    return {
+        'daily': list(orders.order_by('order_date').values_list('order_date').annotate(Sum('line_total'))),
+        'customer': list(orders.order_by('customer_id').values_list(
+            'customer_id', 'customer__name').annotate(Sum('line_total'))),
+        'product': list(orders.order_by('product_id').values_list('product_id').annotate(Sum('quantity'))),
+    }
+
+
 @login_required(login_url='sales:login')
 def data_view(request):
-    sales_vs_day = Order.objects.order_by('order_date').values('order_date').annotate(
-        total_sales=Sum(F('quantity') * F('product__price')))
+    # Orders are spread over the shards, so each one is aggregated in parallel
+    # and the partial sums are merged here
+    results = sharding.scatter_gather(_shard_sales)
+
+    daily_sales = {}
+    customer_sales = {}
+    product_quantity = {}
+    for result in results:
+        for order_date, total in result['daily']:
+            daily_sales[order_date] = daily_sales.get(order_date, 0) + (total or 0)
+        for customer_id, name, total in result['customer']:
+            # Only orders without a customer are grouped on more than one shard
+            previous = customer_sales.get(customer_id, (name, 0))[1]
+            customer_sales[customer_id] = (name, previous + (total or 0))
+        for product_id, quantity in result['product']:
+            product_quantity[product_id] = product_quantity.get(product_id, 0) + (quantity or 0)
+
     data_1 = []
-    for obj in sales_vs_day:
+    for order_date in sorted(daily_sales):
         item = {
-            'date': obj['order_date'],
-            'daily_sales': obj['total_sales']
+            'date': order_date,
+            'daily_sales': daily_sales[order_date]
         }
         data_1.append(item)
 
-    customer_vs_sales = Order.objects.order_by('-customer__id').values('customer__name').annotate(
-        total_sales=Sum(F('quantity') * F('product__price')))
     data_2 = []
-    for obj in customer_vs_sales:
+    for customer_id in sorted(customer_sales, key=lambda pk: (pk is not None, pk or 0), reverse=True):
+        name, total = customer_sales[customer_id]
         item = {
-            'customer_name': obj['customer__name'],
-            'sales_sum': obj['total_sales']
+            'customer_name': name,
+            'sales_sum': total
         }
         data_2.append(item)
 
-    product_vs_quantity = Order.objects.order_by('product__id').values('product__name').annotate(
-        sum=Sum('quantity'))
+    names = product_names()
     data_3 = []
-    for obj in product_vs_quantity:
+    for product_id in sorted(product_quantity, key=lambda pk: (pk is not None, pk or 0)):
         item = {
-            'product_name': obj['product__name'],
-            'quantity_sum': obj['sum']
+            'product_name': names.get(product_id),
+            'quantity_sum': product_quantity[product_id]
         }
         data_3.append(item)
 
@@ -160,17 +187,50 @@ def data_view(request):
     return JsonResponse(context, safe=False)
 
 
+# Metrics
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or (token and constant_time_compare(authorization, 'Bearer ' + token))):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Profiler captures
+@user_passes_test(lambda user: user.is_staff, login_url='sales:login')
+def profile_capture_list(request):
+    context = {'capture_list': profiler.list_captures()}
+    return render(request, 'sales/profile-captures.html', context)
+
+
+@user_passes_test(lambda user: user.is_staff, login_url='sales:login')
+def profile_capture_download(request, filename):
+    path = profiler.capture_path(filename)
+    if path is None:
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+
+
 # Dashboard
 @login_required(login_url='sales:login')
 def home_view(request):
-    order_list = Order.objects.all().order_by('-id')
-    customer_list = Customer.objects.all().order_by('-id')
+    # Orders are read from the denormalized dashboard rows, a single-table scan
+    order_list = DashboardOrderRow.objects.all().order_by('-order_id')
+    customer_list = Customer.objects.all()
 
     # Customer search
     search_value = request.GET.get('q')
     if search_value != '' and search_value is not None:
         customer_list = customer_list.filter(name__icontains=search_value)
 
+    # Customers of every rep, merged from all shards
+    customer_list = sharding.ShardedList(customer_list)
+
+    etag = conditional.etag_for(request, order_list, *customer_list.per_shard())
+    response = conditional.not_modified(request, etag)
+    if response is not None:
+        return response
+
     # Pagination of customers
     p = Paginator(customer_list, 3)
     page_num1 = request.GET.get('page', 1)
@@ -191,52 +251,89 @@ def home_view(request):
         'customer_list': customer_list,
         'order_list': order_list
     }
-    return render(request, 'sales/index.html', context)
+    return conditional.with_etag(render(request, 'sales/index.html', context), etag)
 
 
 # View customer
 @login_required(login_url='sales:login')
 def customer_view(request, pk):
-    customer = Customer.objects.get(pk=pk)
+    # Another rep's customer may live on another shard, so a miss is treated
+    # like any customer the user may not see
+    customer = Customer.objects.filter(pk=pk).first()
 
-    if request.user.profile.id == customer.user_profile.id:
+    if customer is not None and request.user.profile.id == customer.user_profile_id:
 
         order_list = customer.order_set.all().order_by('-id')
-        total_price_sum = 0
-        for order in order_list:
-            total_price_sum += order.total_price()
-        num_of_order = order_list.count()
-        closed_order = order_list.filter(status='Delivered').count()
-        order_in_progress = order_list.exclude(status='Delivered').count()
+
+        # Product names come from the catalog, so the version they are read
+        # from is part of the tag
+        etag = conditional.etag_for(request, order_list, extra=[customer.updated_at, catalog_cache.version()])
+        response = conditional.not_modified(request, etag)
+        if response is not None:
+            return response
+
+        summary = order_list.aggregate(
+            total_price_sum=Sum('line_total'),
+            num_of_order=Count('id'),
+            closed_order=Count('id', filter=Q(status='Delivered')),
+        )
 
         # Order filter
         order_filter = OrderFilter(request.GET, queryset=order_list)
-        order_list = order_filter.qs
+        order_facets = order_filter.facets(product_names())
+        order_list = order_filter.qs.prefetch_related('product')
 
         # Pagination of orders
         p = Paginator(order_list, 5)
+        if order_facets is not None:
+            # The facet query has already counted the filtered orders
+            p.count = order_facets['total']
         page_number = request.GET.get('page', 1)
         try:
             order_list = p.page(page_number)
         except EmptyPage:
             order_list = p.page(1)
 
+        filter_query = request.GET.copy()
+        filter_query.pop('page', None)
+
         context = {
             'customer': customer,
             'order_list': order_list,
-            'total_price_sum': total_price_sum,
-            'num_of_order': num_of_order,
-            'closed_order': closed_order,
-            'order_in_progress': order_in_progress,
+            'total_price_sum': summary['total_price_sum'] or 0,
+            'num_of_order': summary['num_of_order'],
+            'closed_order': summary['closed_order'],
+            'order_in_progress': summary['num_of_order'] - summary['closed_order'],
             'order_filter': order_filter,
+            'order_facets': order_facets,
+            'filter_query': filter_query.urlencode(),
         }
-        return render(request, 'sales/detail.html', context)
+        return conditional.with_etag(render(request, 'sales/detail.html', context), etag)
 
     else:
         messages.info(request, 'You are not authorized to view this page...')
         return redirect('sales:index')
 
 
+# Duplicate customers
+@login_required(login_url='sales:login')
+def customer_duplicates(request):
+    customer_list = Customer.objects.filter(user_profile=request.user.profile)
+
+    if request.method == 'POST':
+        pairs = []
+        for value in request.POST.getlist('merge'):
+            customer_id, _, duplicate_id = value.partition(':')
+            if customer_id.isdigit() and duplicate_id.isdigit():
+                pairs.append((int(customer_id), int(duplicate_id)))
+        merged = dedup.merge_pairs(customer_list, pairs)
+        messages.success(request, 'Merged ' + str(merged) + ' duplicate customers.')
+        return redirect('sales:customer-duplicates')
+
+    context = {'duplicate_list': dedup.find_duplicates(customer_list)}
+    return render(request, 'sales/customer-duplicates.html', context)
+
+
 # Create customer
 @login_required(login_url='sales:login')
 def customer_create(request):
@@ -252,6 +349,10 @@ def customer_create(request):
             instance.save()
             customer_name = form.cleaned_data.get('name')
             messages.success(request, 'Successfully created customer:  ' + customer_name)
+            similar = dedup.similar_customers(instance)
+            if similar:
+                messages.warning(request, 'Possible duplicate of:  ' + ', '.join(str(c) for c in similar)
+                                 + '. Review it under Duplicates.')
             return redirect('sales:index')
 
     context = {'form': form, 'profile': profile, 'title': 'Add a New Customer'}
@@ -261,9 +362,9 @@ def customer_create(request):
 # Update customer
 @login_required(login_url='sales:login')
 def customer_update(request, pk):
-    customer = Customer.objects.get(pk=pk)
+    customer = Customer.objects.filter(pk=pk).first()
 
-    if request.user.profile.id == customer.user_profile.id:
+    if customer is not None and request.user.profile.id == customer.user_profile_id:
         form = CustomerForm(instance=customer)
 
         if request.method == 'POST':
@@ -285,9 +386,9 @@ def customer_update(request, pk):
 # Delete customer
 @login_required(login_url='sales:login')
 def customer_delete(request, pk):
-    customer = Customer.objects.get(pk=pk)
+    customer = Customer.objects.filter(pk=pk).first()
 
-    if request.user.profile.id == customer.user_profile.id:
+    if customer is not None and request.user.profile.id == customer.user_profile_id:
         if request.method == 'POST':
             customer.delete()
             messages.warning(request, str(customer) + ' has been deleted.')
@@ -300,26 +401,69 @@ def customer_delete(request, pk):
         return redirect('sales:index')
 
 
+# Low stock alerts
+def _stock_warning(request, opened):
+    if opened:
+        messages.warning(request, 'Needs reorder:  ' + ', '.join(
+            str(alert.product) + ' (' + str(alert.inventory) + ' left)' for alert in opened))
+
+
 # View products
 @login_required(login_url='sales:login')
 def product_view(request):
     product_list = Product.objects.all().order_by('-id')
     product_filter = ProductFilter(request.GET, queryset=product_list)
+    cached = not any(request.GET.get(name) for name in product_filter.filters)
+
+    # The tag comes from the same source as the body: the catalog version for
+    # the cached catalog, the table itself otherwise. The reorder queue is
+    # rendered too, so its alerts are part of the tag.
+    if cached:
+        etag = conditional.etag_for(request, extra=[catalog_cache.version()] + alerts.validator())
+    else:
+        etag = conditional.etag_for(request, product_list, extra=alerts.validator())
+    response = conditional.not_modified(request, etag)
+    if response is not None:
+        return response
+
     product_list = product_filter.qs
 
+    # The unfiltered catalog and its facet counts are served from the catalog cache
+    if cached:
+        product_list = CachedProductList()
+        product_facets = product_filter.facets(catalog_cache.get('facets', product_filter.facet_counts))
+    else:
+        product_facets = product_filter.facets()
+
     # Pagination of products
     p = Paginator(product_list, 5)
+    if product_facets is not None:
+        # The facet query has already counted the filtered products
+        p.count = product_facets['total']
     page_number = request.GET.get('page', 1)
     try:
         product_list = p.page(page_number)
     except EmptyPage:
         product_list = p.page(1)
 
+    filter_query = request.GET.copy()
+    filter_query.pop('page', None)
+
+    # Needs reorder queue, oldest alerts first
+    reorder_list = list(alerts.reorder_queue()[:10])
+    reorder_count = len(reorder_list)
+    if reorder_count == 10:
+        reorder_count = alerts.reorder_queue().count()
+
     context = {
+        'reorder_list': reorder_list,
+        'reorder_count': reorder_count,
         'product_list': product_list,
-        'product_filter': product_filter
+        'product_filter': product_filter,
+        'product_facets': product_facets,
+        'filter_query': filter_query.urlencode(),
     }
-    return render(request, 'sales/product.html', context)
+    return conditional.with_etag(render(request, 'sales/product.html', context), etag)
 
 
 # Create product
@@ -331,9 +475,10 @@ def product_create(request):
         form = ProductForm(request.POST)
 
         if form.is_valid():
-            form.save()
+            product = form.save()
             product_name = form.cleaned_data.get('name')
             messages.success(request, 'Successfully created product:  ' + product_name)
+            _stock_warning(request, alerts.evaluate([product]))
             return redirect('sales:product')
 
     context = {'form': form, 'title': 'Create a New Product'}
@@ -350,9 +495,10 @@ def product_update(request, product_id):
         form = ProductForm(request.POST, instance=product)
 
         if form.is_valid():
-            form.save()
+            product = form.save()
             product_name = request.POST.get('name')
             messages.success(request, 'Successfully updated product:  ' + product_name)
+            _stock_warning(request, alerts.evaluate([product]))
             return redirect('sales:product')
 
     context = {'form': form, 'title': 'Update Product Information'}
@@ -374,10 +520,10 @@ def product_delete(request, product_id):
 # Create order
 @login_required(login_url='sales:login')
 def order_create(request, pk):
-    customer = Customer.objects.get(pk=pk)
+    customer = Customer.objects.filter(pk=pk).first()
 
-    if request.user.profile.id == customer.user_profile.id:
-        OrderFormSet = inlineformset_factory(Customer, Order, fields=('product', 'quantity', 'status'), max_num=3, can_delete=False)
+    if customer is not None and request.user.profile.id == customer.user_profile_id:
+        OrderFormSet = inlineformset_factory(Customer, Order, form=OrderLineForm, fields=('product', 'quantity', 'status'), max_num=3, can_delete=False)
         formset = OrderFormSet(queryset=Order.objects.none(), instance=customer)
 
         if request.method == 'POST':
@@ -386,6 +532,7 @@ def order_create(request, pk):
                 formset.save()
 
                 # Update product inventory
+                touched = []
                 for form in formset:
                     ordered_product = form.cleaned_data.get('product')
                     ordered_quantity = form.cleaned_data.get('quantity')
@@ -393,7 +540,9 @@ def order_create(request, pk):
                     if product is not None:
                         product.inventory -= ordered_quantity
                         product.save()
+                        touched.append(product)
                 messages.success(request, 'Successfully created order.')
+                _stock_warning(request, alerts.evaluate(touched))
                 return HttpResponseRedirect(reverse('sales:detail', kwargs={'pk': customer.id}))
 
         context = {'formset': formset, 'title': 'Create New Orders'}
@@ -407,7 +556,7 @@ def order_create(request, pk):
 @login_required(login_url='sales:login')
 def order_update(request, pk, order_id):
     customer = get_object_or_404(Customer, pk=pk)
-    order = Order.objects.get(pk=order_id)
+    order = get_object_or_404(customer.order_set, pk=order_id)
 
     if request.user.profile.id == customer.user_profile.id:
         form = OrderForm(instance=order)
@@ -431,7 +580,7 @@ def order_update(request, pk, order_id):
 @login_required(login_url='sales:login')
 def order_delete(request, pk, order_id):
     customer = get_object_or_404(Customer, pk=pk)
-    order = Order.objects.get(pk=order_id)
+    order = get_object_or_404(customer.order_set, pk=order_id)
 
     if request.user.profile.id == customer.user_profile.id:
         if request.method == 'POST':
@@ -444,6 +593,7 @@ def order_delete(request, pk, order_id):
             if product is not None:
                 product.inventory += quantity
                 product.save()
+                alerts.evaluate([product])
             messages.warning(request, 'Order:  ' + str(product) + ' - ' + str(quantity) + ' has been deleted.')
             return HttpResponseRedirect(reverse('sales:detail', kwargs={'pk': customer.id}))
 